@@ -18,11 +18,83 @@
 # run batch job to update archive from archive/batch.json (or other batch file)
 # python scrape.py --batch <optional: path/to/batch.json>
 
+# run batch job with up to 4 concurrent fetches and 4 parsing processes (output order unchanged)
+# (each list comes back from its parsing process whole, rather than being written as it's parsed)
+# python scrape.py --batch --jobs 4
+
+# write scrape output as NDJSON (one update per line, written as parsed) instead of pretty JSON
+# python scrape.py https://classweb.org/approved-subjects/2111b.html 2021-11-12 --format ndjson
+# python scrape.py --batch --format ndjson
+
+# batch runs don't touch tweets unless --publish is given; uploads run concurrently and skip objects that are already identical
+# python scrape.py --batch --publish --jobs 4
+# python scrape.py --batch --publish --s3-endpoint http://localhost:9000 # e.g., local MinIO
+
+# batch runs skip lists whose source html and scrape.py are unchanged since the last run (see archive/manifest.json)
+# with --publish, tweets for unchanged lists are still built (from the archived scrape) and published if they're not in s3 yet
+# python scrape.py --batch --force # rescrape everything regardless
+
+# query archived updates (archive/index.sqlite is built/updated automatically, and as lists are saved)
+# python scrape.py query "Science-fiction" # full-text search on lines, as a phrase
+# python scrape.py query "aliens AND NOT film*" --fts # FTS5 query syntax
+# python scrape.py query --record sh85003553
+# python scrape.py query --status cancelled --type genreFormTerm --from 2022-01 --to 2022-06
+
+# show every archived update to a record, in list order (or export all records' histories as JSON)
+# python scrape.py history sh85003553
+# python scrape.py history --export history.json
+
+# benchmark parse/tweets/serialize over every archived list (offline) and check output still matches archive/scrape/
+# results are appended to bench/results.ndjson and compared against the previous run
+# python scrape.py bench
+
+# watch the ClassWeb index for lists not in archive/batch.json yet, scrape/save/publish them with the next IDs
+# (polls every --interval seconds with conditional GETs, backing off after errors; --once polls a single time, e.g., from cron)
+# python scrape.py watch
+# python scrape.py watch --skip-tweets --interval 600
+# python scrape.py watch --once --index-url http://localhost:8000/ # e.g., a local stand-in for the index
+
+# diff a republished list against its archived scrape (by record ID), writing output/diff.json and tweets.json for added/modified updates only
+# --save replaces the archived copy, --publish pushes the changes-only thread to s3 as <saveName>--changes--<today>.json
+# python scrape.py diff https://classweb.org/approved-subjects/2210.html 2022-10-14 0046
+# python scrape.py diff https://classweb.org/approved-subjects/2210.html 2022-10-14 0046 --save --publish
+
+# pack archive/source/ and archive/scrape/ into archive/store/ (gzipped, content-addressed, deduplicated)
+# once archive/store/refs.json exists, saves/batch runs/queries read and write the store instead of the plain layout
+# python scrape.py store import
+# python scrape.py store export # back to archive/source/ and archive/scrape/ (or: store export path/to/dir --format ndjson)
+# python scrape.py store gc # delete objects no longer in refs.json (rescrapes leave the old scrape object behind)
+
+# export the archive (or --from/--to a range of list dates) to flat tables: updates.csv (typed true/false status columns)
+# and lines.csv (one row per line, MARC tag split from text, joined on updateId); --parquet writes Parquet instead (needs pyarrow)
+# python scrape.py export # to export/
+# python scrape.py export path/to/dir --from 2022-01 --to 2022-12 --parquet
+
+# every scrape/batch run prints per-list stage timings (fetch, tokenize, classify, tweets, write, index, upload)
+# and appends them to output/timings.ndjson, one record per list plus a totals record per batch
+# --profile wraps the run in cProfile/tracemalloc and writes output/profile.txt (and output/profile.pstats)
+# python scrape.py --batch --offline --force --profile
+
+# regenerate archive/scrape/ from archive/source/ without touching the network (falls back to cache/http/)
+# python scrape.py --batch --offline
+
+# LIBRARY USE
+# importing scrape.py doesn't read the command line; options keep their defaults (pretty JSON, no publishing, plain archive)
+# import scrape
+# scrapeJSON = scrape.parseList(sourceHTML, "https://classweb.org/approved-subjects/2111b.html", "2021-11-12") # list of UpdateRecords
+# updateDicts = [update.toDict() for update in scrapeJSON] # UpdateRecords aren't JSON-serializable, toDict() gives the saved form
+# tweetsJSON = scrape.toTwitterJSON(scrapeJSON)
+# scrape.saveFiles(listSourceURL, dateISO, None, scrapeJSON, sourceHTML, tweetsJSON) # to output/ (or to the archive, with a saveId)
+# scrape.main(["scrape.py", "--batch", "--offline"]) # same as running from the command line
+# each main() call starts fresh (S3 client, HTTP session and archive layout are set up again from that call's options)
+# --jobs starts parsing processes that re-import the calling script, so call main() under if __name__ == "__main__":
+
 # NOTES
 # approved subject lists here: https://classweb.org/approved-subjects/
 # currently monitoring with Versionista
 # scrape/save approved lists as they're released with IDs counting up from 0001
 # ID numbering doesn't need to reflect approval date chronology, e.g., 0002--2021-11-23--2111y, 0003--2021-11-15--2111
+# fetched lists are cached in cache/http/ and revalidated with ETag/Last-Modified (safe to delete)
 
 # dates come from HTML file (manually check)
 # for list dates with no day, use YYYY-MM
@@ -37,45 +109,214 @@ from datetime import date
 from pathlib import Path
 import json
 import re
-import textwrap
-import requests
-from bs4 import BeautifulSoup
-import boto3
-
-batchMode = True if sys.argv[1] == "--batch" else False
-if batchMode:
-    inputBatchPath = sys.argv[2] if len(sys.argv) > 2 else "archive/batch.json"
-    inputListSourceURL = inputDateISO = inputSaveId = None
-    skipTweetsMode = True
-    saveRunMode = False
-else:
-    inputListSourceURL = sys.argv[1]
-    inputDateISO = sys.argv[2]
-    inputSaveId = sys.argv[3] if len(sys.argv) > 3 else None
-    skipTweetsMode = True if "--skip-tweets" in sys.argv else False
-    saveRunMode = True if "--save-run" in sys.argv else False
-
-def newUpdateObj(headingType, dateISO, listSourceURL):
-    return {
-        "headingType": headingType,
-        "listDate": dateISO,
-        "listSource": listSourceURL,
-        "LCLinkedDataURI": None,
-        "LCCNPermalink": None,
-        "statusApprovedBeforeMeeting": False,
-        "statusSubmittedByCoopLib": False,
-        "statusNewHeading": False,
-        "statusChangedHeading": False,
-        "statusCancelledHeading": False,
-        "statusUpdatedField": False,
-        "statusAddedField": False,
-        "statusDeletedField": False,
-        "statusUpdatedGeog": False,
-        "statusAddedGeog": False,
-        "statusDeletedGeog": False,
-        "statusChangedGeog": False,
-        "lines": []
-    }
+import hashlib
+import sqlite3
+import csv
+import gzip
+import io
+import time
+import tracemalloc
+import subprocess
+import platform
+import random
+import threading
+import multiprocessing
+import cProfile
+import pstats
+from contextlib import contextmanager, nullcontext
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from html.parser import HTMLParser
+from urllib.parse import urljoin
+# requests and boto3 are slow to import, so they're only imported on the paths that use them (getHttpSession, runWatch, S3 publishing)
+
+# returns value following an option flag, e.g., --jobs 4
+def getOptionValue(option, default=None):
+    if option not in commandArgs: return default
+    optionIndex = commandArgs.index(option)
+    if optionIndex + 1 >= len(commandArgs): raise Exception("Expected value after option: ", option)
+    return commandArgs[optionIndex + 1]
+
+# positional args only, skipping option flags and their values
+def getPositionalArgs():
+    optionsWithValues = ["--jobs", "--format", "--record", "--type", "--status", "--from", "--to", "--export", "--s3-endpoint", "--index-url", "--interval"]
+    positionalArgs = []
+    skipNext = False
+    for arg in commandArgs[1:]:
+        if skipNext:
+            skipNext = False
+        elif arg in optionsWithValues:
+            skipNext = True
+        elif not arg.startswith("--"):
+            positionalArgs.append(arg)
+    return positionalArgs
+
+# defaults for library use (import scrape), where nothing is read from the command line; main() sets these from argv
+commandArgs = ["scrape.py"]
+batchMode = queryMode = historyMode = benchMode = watchMode = diffMode = storeMode = exportMode = False
+inputJobs = 1
+offlineMode = forceMode = profileMode = False
+outputFormat = "json"
+skipTweetsMode = True
+saveRunMode = False
+inputBatchPath = inputListSourceURL = inputDateISO = inputSaveId = inputQueryText = None
+inputIndexURL = "https://classweb.org/approved-subjects/"
+inputPollSeconds = 3600.0
+inputStoreCommand = None
+inputExportPath = Path("archive")
+
+def parseArgs(argv):
+    global commandArgs, batchMode, queryMode, historyMode, benchMode, watchMode, diffMode, storeMode, exportMode, inputJobs, offlineMode, forceMode, profileMode, outputFormat
+    global skipTweetsMode, saveRunMode, inputBatchPath, inputListSourceURL, inputDateISO, inputSaveId, inputQueryText, inputIndexURL, inputPollSeconds, inputStoreCommand, inputExportPath
+    if len(argv) < 2: raise Exception("Expected list url and date, --batch, or a command (see top of scrape.py), instead: ", argv[1:])
+    commandArgs = argv
+    batchMode = True if commandArgs[1] == "--batch" else False
+    queryMode = True if commandArgs[1] == "query" else False
+    historyMode = True if commandArgs[1] == "history" else False
+    benchMode = True if commandArgs[1] == "bench" else False
+    watchMode = True if commandArgs[1] == "watch" else False
+    diffMode = True if commandArgs[1] == "diff" else False
+    storeMode = True if commandArgs[1] == "store" else False
+    exportMode = True if commandArgs[1] == "export" else False
+    inputJobs = int(getOptionValue("--jobs", 1))
+    offlineMode = True if "--offline" in commandArgs else False
+    forceMode = True if "--force" in commandArgs else False
+    profileMode = True if "--profile" in commandArgs else False
+    outputFormat = getOptionValue("--format", "json")
+    if outputFormat not in ["json", "ndjson"]: raise Exception("Expected --format to be json or ndjson, instead: ", outputFormat)
+    if batchMode:
+        inputBatchPath = getPositionalArgs()[0] if getPositionalArgs() else "archive/batch.json"
+        inputListSourceURL = inputDateISO = inputSaveId = None
+        skipTweetsMode = False if "--publish" in commandArgs else True
+        saveRunMode = False
+    elif benchMode:
+        inputBatchPath = getPositionalArgs()[1] if len(getPositionalArgs()) > 1 else "archive/batch.json"
+        inputListSourceURL = inputDateISO = inputSaveId = None
+        skipTweetsMode = True
+        saveRunMode = False
+    elif watchMode:
+        inputIndexURL = getOptionValue("--index-url", "https://classweb.org/approved-subjects/")
+        inputPollSeconds = float(getOptionValue("--interval", 3600))
+        inputListSourceURL = inputDateISO = inputSaveId = None
+        skipTweetsMode = True if "--skip-tweets" in commandArgs else False
+        saveRunMode = False # scrapeNewLists appends to archive/batch.json itself, once a list is saved and published
+    elif diffMode:
+        inputListSourceURL = getPositionalArgs()[1]
+        inputDateISO = getPositionalArgs()[2]
+        inputSaveId = getPositionalArgs()[3]
+        skipTweetsMode = True # saveFiles never publishes the full thread here, only tweets for changes are published
+        saveRunMode = False
+    elif storeMode:
+        inputStoreCommand = getPositionalArgs()[1] if len(getPositionalArgs()) > 1 else None
+        if inputStoreCommand not in ["import", "export", "gc"]: raise Exception("Expected store import, store export or store gc, instead: ", inputStoreCommand)
+        inputExportPath = Path(getPositionalArgs()[2] if len(getPositionalArgs()) > 2 else "archive")
+        inputListSourceURL = inputDateISO = inputSaveId = None
+        skipTweetsMode = True
+        saveRunMode = False
+    elif exportMode:
+        inputExportPath = Path(getPositionalArgs()[1] if len(getPositionalArgs()) > 1 else "export")
+        inputListSourceURL = inputDateISO = inputSaveId = None
+        skipTweetsMode = True
+        saveRunMode = False
+    elif queryMode or historyMode:
+        inputQueryText = getPositionalArgs()[1] if len(getPositionalArgs()) > 1 else None
+        inputListSourceURL = inputDateISO = inputSaveId = None
+        skipTweetsMode = True
+        saveRunMode = False
+    else:
+        inputListSourceURL = getPositionalArgs()[0]
+        inputDateISO = getPositionalArgs()[1]
+        inputSaveId = getPositionalArgs()[2] if len(getPositionalArgs()) > 2 else None
+        skipTweetsMode = True if "--skip-tweets" in commandArgs else False
+        saveRunMode = True if "--save-run" in commandArgs else False
+
+# status flags in scrape.json key order, each packed into one bit of UpdateRecord.statusFlags
+updateStatusKeys = [
+    "statusApprovedBeforeMeeting",
+    "statusSubmittedByCoopLib",
+    "statusNewHeading",
+    "statusChangedHeading",
+    "statusCancelledHeading",
+    "statusUpdatedField",
+    "statusAddedField",
+    "statusDeletedField",
+    "statusUpdatedGeog",
+    "statusAddedGeog",
+    "statusDeletedGeog",
+    "statusChangedGeog"
+]
+updateStatusBits = {statusKey: 1 << statusIndex for statusIndex, statusKey in enumerate(updateStatusKeys)}
+
+# compact stand-in for the 17-key update dict; supports update["key"] reads/writes like the dict did
+# listInfo is a (listDate, listSource) tuple shared by every update from the same list
+class UpdateRecord:
+    __slots__ = ("headingType", "listInfo", "LCLinkedDataURI", "LCCNPermalink", "statusFlags", "lines")
+
+    def __init__(self, headingType, listInfo):
+        self.headingType = headingType
+        self.listInfo = listInfo
+        self.LCLinkedDataURI = None
+        self.LCCNPermalink = None
+        self.statusFlags = 0
+        self.lines = []
+
+    def __getitem__(self, key):
+        statusBit = updateStatusBits.get(key)
+        if statusBit: return bool(self.statusFlags & statusBit)
+        if key == "listDate": return self.listInfo[0]
+        if key == "listSource": return self.listInfo[1]
+        if key not in UpdateRecord.__slots__: raise KeyError(key)
+        return getattr(self, key)
+
+    def __setitem__(self, key, value):
+        statusBit = updateStatusBits.get(key)
+        if statusBit:
+            self.statusFlags = self.statusFlags | statusBit if value else self.statusFlags & ~statusBit
+        elif key in ["headingType", "LCLinkedDataURI", "LCCNPermalink", "lines"]:
+            setattr(self, key, value)
+        else:
+            raise KeyError(key)
+
+    # same keys, same order as scrape.json
+    def toDict(self):
+        updateDict = {
+            "headingType": self.headingType,
+            "listDate": self.listInfo[0],
+            "listSource": self.listInfo[1],
+            "LCLinkedDataURI": self.LCLinkedDataURI,
+            "LCCNPermalink": self.LCCNPermalink
+        }
+        for statusKey in updateStatusKeys:
+            updateDict[statusKey] = bool(self.statusFlags & updateStatusBits[statusKey])
+        updateDict["lines"] = self.lines
+        return updateDict
+
+    @staticmethod
+    def fromDict(updateDict, listInfo=None):
+        newUpdate = UpdateRecord(updateDict["headingType"], listInfo or (updateDict["listDate"], updateDict["listSource"]))
+        newUpdate.LCLinkedDataURI = updateDict["LCLinkedDataURI"]
+        newUpdate.LCCNPermalink = updateDict["LCCNPermalink"]
+        for statusKey in updateStatusKeys:
+            if updateDict[statusKey]: newUpdate.statusFlags |= updateStatusBits[statusKey]
+        newUpdate.lines = updateDict["lines"]
+        return newUpdate
+
+def newUpdateObj(headingType, listInfo):
+    return UpdateRecord(headingType, listInfo)
+
+# load an archived scrape (.json or .ndjson) as UpdateRecords, sharing listInfo across updates from the same list
+def loadUpdates(scrapePath):
+    with open(scrapePath, "r") as infile:
+        if str(scrapePath).endswith(".ndjson"):
+            updateDicts = (json.loads(line) for line in infile if line.strip())
+        else:
+            updateDicts = json.load(infile)
+
+        loadedUpdates = []
+        listInfos = {}
+        for updateDict in updateDicts:
+            listInfo = listInfos.setdefault((updateDict["listDate"], updateDict["listSource"]), (updateDict["listDate"], updateDict["listSource"]))
+            loadedUpdates.append(UpdateRecord.fromDict(updateDict, listInfo))
+        return loadedUpdates
 
 # removes extra spaces between words, also removes any trailing and leading spaces
 def squashSpaces(s):
@@ -136,79 +377,552 @@ def getPrettyDate(inputDate):
         return date.fromisoformat(dateTemp).strftime("%b. %Y")
 
 # twitter double-weights characters unless they fall in certain unicode ranges (see https://developer.twitter.com/en/docs/counting-characters)
-def isSpecial(chr):
-    chrVal = ord(chr)
-    if (
-        chrVal <= int(0x10FF)
-        or (chrVal >= int(0x2000) and chrVal <= int(0x200D))
-        or (chrVal >= int(0x2010) and chrVal <= int(0x201F))
-        or (chrVal >= int(0x2032) and chrVal <= int(0x2037))
-    ):
-        # e.g., the é in café is single-weighted
-        return False
-    else:
-        # e.g., the ṭ shṭraimels is double-weighted
-        return True
+# e.g., the é in café is single-weighted, the ṭ in shṭraimels is double-weighted
+doubleWeightedPattern = re.compile("[^\u0000-\u10FF\u2000-\u200D\u2010-\u201F\u2032-\u2037]")
 
-def countSpecialCharacters(inputString):
-    return len([chr for chr in inputString if isSpecial(chr)])
+def getTweetWeight(text):
+    return len(text) + len(doubleWeightedPattern.findall(text))
 
-def getLongestHeading(scrapeJSON):
-    maxLen, maxTxt = 0, ""
-    for update in scrapeJSON:
-        headerTxt = update["lines"][0]
-        headerLen = len(headerTxt)
-        if headerLen > maxLen:
-            maxLen = headerLen
-            maxTxt = headerTxt
-    return maxLen, maxTxt
+# split at whitespace into (separator, word) pairs, breaking any word too long for a middle tweet into pieces
+def getTweetWords(tweetBody, maxPieceWeight):
+    tweetWords = []
+    for wordMatch in re.finditer(r"(\s*)(\S+)", tweetBody):
+        separator, word = wordMatch.group(1), wordMatch.group(2)
+        while getTweetWeight(word) > maxPieceWeight:
+            pieceEnd = maxPieceWeight // 2
+            while getTweetWeight(word[:pieceEnd + 1]) <= maxPieceWeight: pieceEnd += 1
+            tweetWords.append((separator, word[:pieceEnd]))
+            separator, word = "", word[pieceEnd:]
+        tweetWords.append((separator, word))
+    return tweetWords
+
+# pack tweetBody into as few tweets as possible, each exactly within maxWeight including "..." affixes
+def splitTweetBody(tweetBody, maxWeight=280):
+    if getTweetWeight(tweetBody) <= maxWeight: return [tweetBody]
+
+    tweetWords = getTweetWords(tweetBody, maxWeight - 6)
+    wordWeights = [(getTweetWeight(separator), getTweetWeight(word)) for separator, word in tweetWords]
+
+    # remainingWeights[i] = weight of everything from word i on, if word i starts a tweet (leading separator dropped)
+    remainingWeights = [0] * (len(tweetWords) + 1)
+    for wordIndex in range(len(tweetWords) - 1, -1, -1):
+        nextSeparatorWeight = wordWeights[wordIndex + 1][0] if wordIndex + 1 < len(tweetWords) else 0
+        remainingWeights[wordIndex] = wordWeights[wordIndex][1] + nextSeparatorWeight + remainingWeights[wordIndex + 1]
+
+    tweetChunks = []
+    chunkWords, chunkWeight, chunkMaxWeight = [], 0, maxWeight - 3 # first tweet only gets trailing "..."
+    for wordIndex, (separator, word) in enumerate(tweetWords):
+        separatorWeight, wordWeight = wordWeights[wordIndex]
+        if not chunkWords:
+            chunkWords.append(word)
+            chunkWeight = wordWeight
+        elif chunkWeight + separatorWeight + wordWeight <= chunkMaxWeight:
+            chunkWords += [separator, word]
+            chunkWeight += separatorWeight + wordWeight
+        else:
+            tweetChunks.append("".join(chunkWords))
+            # last tweet only gets leading "...", middle tweets get both
+            chunkMaxWeight = maxWeight - 3 if remainingWeights[wordIndex] <= maxWeight - 3 else maxWeight - 6
+            chunkWords, chunkWeight = [word], wordWeight
+    tweetChunks.append("".join(chunkWords))
+
+    return [tweetChunks[0] + "..."] + ["..." + chunk + "..." for chunk in tweetChunks[1:-1]] + ["..." + tweetChunks[-1]]
+
+# e.g., 0001--2021-11-12--2111b
+def getSaveName(listSourceURL, dateISO, saveId):
+    listSourceFilename = Path(listSourceURL).stem # kind of misusing Path module, maybe
+    return f"{saveId}--{dateISO}--{listSourceFilename}"
+
+# scrape files are pretty JSON (.json) or one update per line (.ndjson) depending on --format
+def getScrapeFilename(saveName):
+    return saveName + "." + outputFormat
+
+# ARCHIVE STORAGE
+# plain layout: archive/source/<saveName>.html and archive/scrape/<saveName>.json|ndjson
+# store layout (once archive/store/refs.json exists): gzipped objects named by the sha256 of their contents, so identical
+# re-fetches/re-scrapes are stored once, plus refs.json mapping each saveName to its source and scrape objects
+# scrapes in the store are always NDJSON, so updates can be streamed out of a single list without loading it whole
+storeRefsPath = Path("./archive/store/refs.json")
+archiveStoreMode = storeRefsPath.exists()
+
+def loadStoreRefs():
+    return json.loads(storeRefsPath.read_text()) if storeRefsPath.exists() else {}
+
+# replaced in one step, since fetch threads may be reading refs while a batch run saves
+def saveStoreRefs(storeRefs):
+    if not storeRefsPath.parent.exists(): storeRefsPath.parent.mkdir(parents=True)
+    with open(storeRefsPath.with_suffix(".tmp"), "w") as outfile:
+        json.dump(storeRefs, outfile, indent=2, sort_keys=True)
+        outfile.write("\n")
+    storeRefsPath.with_suffix(".tmp").replace(storeRefsPath)
+
+def getStoreObjectPath(objectHash):
+    return Path("./archive/store/objects/") / objectHash[:2] / (objectHash + ".gz")
+
+# text written here is hashed and gzipped on the way to a temp file, which is moved into place (or dropped, if already stored) on close
+# mtime=0 and no filename in the gzip header, so the same contents always compress to the same bytes
+# use it as a context manager, so the temp file is removed if writing fails before close()
+class StoreObjectWriter:
+    def __init__(self):
+        if not Path("./archive/store/objects/").exists(): Path("./archive/store/objects/").mkdir(parents=True)
+        self.tempPath = Path("./archive/store/objects/") / f"tmp-{random.getrandbits(64):016x}"
+        self.tempFile = open(self.tempPath, "wb")
+        self.gzipFile = gzip.GzipFile(filename="", mode="wb", fileobj=self.tempFile, mtime=0)
+        self.contentHash = hashlib.sha256()
+
+    def write(self, text):
+        textBytes = text.encode("utf-8")
+        self.contentHash.update(textBytes)
+        self.gzipFile.write(textBytes)
+
+    def close(self):
+        self.gzipFile.close()
+        self.tempFile.close()
+        objectHash = self.contentHash.hexdigest()
+        objectPath = getStoreObjectPath(objectHash)
+        if objectPath.exists():
+            self.tempPath.unlink()
+        else:
+            if not objectPath.parent.exists(): objectPath.parent.mkdir(parents=True)
+            self.tempPath.replace(objectPath)
+        return objectHash
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *excInfo):
+        try:
+            self.gzipFile.close()
+            self.tempFile.close()
+        finally:
+            self.tempPath.unlink(missing_ok=True)
+
+# stream-decompressing text reader for one stored object
+def openStoreObject(objectHash):
+    return gzip.open(getStoreObjectPath(objectHash), "rt", encoding="utf-8")
+
+# saveNames of every archived scrape
+def getArchivedNames():
+    if archiveStoreMode: return sorted(loadStoreRefs())
+    return sorted(set(scrapePath.stem for scrapePath in Path("./archive/scrape/").glob("*.*json")))
+
+# with the plain layout, a scrape only counts as archived in the current --format (so switching formats rescrapes)
+def hasArchivedScrape(saveName):
+    if archiveStoreMode: return saveName in loadStoreRefs()
+    return Path("./archive/scrape/" + getScrapeFilename(saveName)).exists()
+
+def getArchivedScrapePath(saveName):
+    for scrapeFilename in [getScrapeFilename(saveName), saveName + ".json", saveName + ".ndjson"]:
+        if Path("./archive/scrape/" + scrapeFilename).exists(): return Path("./archive/scrape/" + scrapeFilename)
+    return None
+
+# identifies the archived scrape's contents, e.g., for skipping lists that are already indexed
+def getArchivedScrapeHash(saveName):
+    if archiveStoreMode: return loadStoreRefs()[saveName]["scrape"]
+    return hashlib.sha256(getArchivedScrapePath(saveName).read_bytes()).hexdigest()
+
+# cheap check for an archived scrape having changed, without reading it: filename, size and mtime in the plain layout
+# (in the store, the object hash from refs.json already is one; pass storeRefs when checking many lists)
+def getArchivedScrapeStat(saveName, storeRefs=None):
+    if archiveStoreMode: return (storeRefs or loadStoreRefs())[saveName]["scrape"]
+    scrapePath = getArchivedScrapePath(saveName)
+    scrapeStat = scrapePath.stat()
+    return f"{scrapePath.name}:{scrapeStat.st_size}:{scrapeStat.st_mtime_ns}"
+
+def readArchivedSource(saveName):
+    if archiveStoreMode:
+        storeRef = loadStoreRefs().get(saveName)
+        if storeRef is None: return None
+        with openStoreObject(storeRef["source"]) as infile:
+            return infile.read()
+    sourcePath = Path("./archive/source/" + saveName + ".html")
+    return sourcePath.read_text(encoding="utf-8") if sourcePath.exists() else None
+
+# archived updates one at a time (streamed from the store, or loaded from the plain layout)
+def iterArchivedUpdates(saveName):
+    if not archiveStoreMode:
+        yield from loadUpdates(getArchivedScrapePath(saveName))
+        return
+    listInfos = {}
+    with openStoreObject(loadStoreRefs()[saveName]["scrape"]) as infile:
+        for line in infile:
+            updateDict = json.loads(line)
+            listInfo = listInfos.setdefault((updateDict["listDate"], updateDict["listSource"]), (updateDict["listDate"], updateDict["listSource"]))
+            yield UpdateRecord.fromDict(updateDict, listInfo)
+
+# written to <path>.tmp and moved into place once the block finishes, so an error partway (e.g., while parsing) leaves the old file as it was
+@contextmanager
+def openReplacing(filePath):
+    tempPath = Path(str(filePath) + ".tmp")
+    try:
+        with open(tempPath, "w") as outfile:
+            yield outfile
+        tempPath.replace(filePath)
+    finally:
+        tempPath.unlink(missing_ok=True)
+
+# write one list's source and scrape (updates may be a generator), returns the number of updates written
+def writeArchivedList(saveName, sourceHTML, updates):
+    if not archiveStoreMode:
+        if not Path("./archive/source/").exists(): Path("./archive/source/").mkdir(parents=True)
+        if not Path("./archive/scrape/").exists(): Path("./archive/scrape/").mkdir(parents=True)
+        # the source only replaces the archived copy once the scrape has been written in full
+        with openReplacing("./archive/source/" + saveName + ".html") as sourceFile, openReplacing("./archive/scrape/" + getScrapeFilename(saveName)) as scrapeFile:
+            sourceFile.write(sourceHTML)
+            return writeUpdates(updates, scrapeFile)
+
+    storeRef, updateCount = storeList(sourceHTML, updates)
+    storeRefs = loadStoreRefs()
+    storeRefs[saveName] = storeRef
+    saveStoreRefs(storeRefs)
+    return updateCount
+
+# store one list's objects, returns its ref (object hashes) and the number of updates written
+def storeList(sourceHTML, updates):
+    with StoreObjectWriter() as sourceWriter, StoreObjectWriter() as scrapeWriter:
+        sourceWriter.write(sourceHTML)
+        updateCount = writeUpdates(updates, scrapeWriter, "ndjson")
+        return {"source": sourceWriter.close(), "scrape": scrapeWriter.close()}, updateCount
+
+# byte-for-byte check of freshly parsed updates against the archived scrape (NDJSON in the store, the archived file's format otherwise)
+def matchesArchivedScrape(saveName, updates):
+    if archiveStoreMode:
+        scrapeBuffer = io.StringIO()
+        writeUpdates(updates, scrapeBuffer, "ndjson")
+        storeRef = loadStoreRefs().get(saveName)
+        return storeRef is not None and storeRef["scrape"] == hashlib.sha256(scrapeBuffer.getvalue().encode("utf-8")).hexdigest()
+
+    scrapePath = getArchivedScrapePath(saveName)
+    if scrapePath is None: return False
+    scrapeBuffer = io.StringIO()
+    writeUpdates(updates, scrapeBuffer, scrapePath.suffix[1:])
+    return scrapePath.read_text() == scrapeBuffer.getvalue()
+
+# pack every list in the plain layout into the store, one list at a time (plain files are left in place, delete them once happy)
+def importStore():
+    storeRefs = loadStoreRefs()
+    for sourcePath in sorted(Path("./archive/source/").glob("*.html")):
+        scrapePath = getArchivedScrapePath(sourcePath.stem)
+        if scrapePath is None: continue
+        storeRefs[sourcePath.stem] = storeList(sourcePath.read_text(encoding="utf-8"), loadUpdates(scrapePath))[0]
+        print(f"Stored: {sourcePath.stem}")
+    saveStoreRefs(storeRefs)
+
+# write the store back out to the plain layout under exportPath (e.g., archive/), scrapes in the current --format
+def exportStore(exportPath):
+    for saveName, storeRef in loadStoreRefs().items():
+        if not (exportPath / "source").exists(): (exportPath / "source").mkdir(parents=True)
+        with openStoreObject(storeRef["source"]) as infile, open(exportPath / "source" / (saveName + ".html"), "w") as outfile:
+            for sourceChunk in iter(lambda: infile.read(65536), ""):
+                outfile.write(sourceChunk)
+
+        if not (exportPath / "scrape").exists(): (exportPath / "scrape").mkdir(parents=True)
+        with open(exportPath / "scrape" / getScrapeFilename(saveName), "w") as outfile:
+            writeUpdates(iterArchivedUpdates(saveName), outfile)
+        print(f"Exported: {saveName}")
+
+# delete objects that refs.json no longer points to (e.g., the old scrape of a list that was rescraped) and temp files left by interrupted writes
+# don't run this while a batch/watch run is writing to the store, since its new objects aren't in refs.json yet
+def collectStoreGarbage():
+    referencedHashes = set(objectHash for storeRef in loadStoreRefs().values() for objectHash in storeRef.values())
+    removedCount = removedBytes = 0
+    objectsPath = Path("./archive/store/objects/")
+    for objectPath in list(objectsPath.glob("*/*.gz")) + list(objectsPath.glob("tmp-*")):
+        if objectPath.stem in referencedHashes: continue
+        removedBytes += objectPath.stat().st_size
+        objectPath.unlink()
+        removedCount += 1
+    print(f"Removed {removedCount} unreferenced objects ({removedBytes} bytes)")
+
+# http response cache keyed by url, revalidated with ETag/Last-Modified
+def getCachePaths(listSourceURL):
+    cacheKey = hashlib.sha256(listSourceURL.encode("utf-8")).hexdigest()
+    return Path("./cache/http/") / (cacheKey + ".html"), Path("./cache/http/") / (cacheKey + ".json")
+
+# one keep-alive session (and connection pool) shared by every fetch, including concurrent batch fetches
+# (created under a lock, since the first calls can come from several fetch threads at once)
+httpSession = None
+httpSessionLock = threading.Lock()
+
+def getHttpSession():
+    global httpSession
+    with httpSessionLock:
+        if httpSession is None:
+            import requests
+            httpSession = requests.Session()
+            httpSession.mount("http://", requests.adapters.HTTPAdapter(pool_maxsize=max(10, inputJobs)))
+            httpSession.mount("https://", requests.adapters.HTTPAdapter(pool_maxsize=max(10, inputJobs)))
+    return httpSession
+
+def fetchCached(listSourceURL):
+    cacheBodyPath, cacheMetaPath = getCachePaths(listSourceURL)
+    cacheMeta = json.loads(cacheMetaPath.read_text()) if cacheMetaPath.exists() and cacheBodyPath.exists() else None
+
+    requestHeaders = {}
+    if cacheMeta and cacheMeta["etag"]: requestHeaders["If-None-Match"] = cacheMeta["etag"]
+    if cacheMeta and cacheMeta["lastModified"]: requestHeaders["If-Modified-Since"] = cacheMeta["lastModified"]
+
+    response = getHttpSession().get(listSourceURL, headers=requestHeaders, timeout=60)
+    if response.status_code == 304 and cacheMeta:
+        return cacheBodyPath.read_text(encoding="utf-8")
+    response.raise_for_status()
+
+    sourceHTML = response.text
+    if not Path("./cache/http/").exists(): Path("./cache/http/").mkdir(parents=True)
+    cacheBodyPath.write_text(sourceHTML, encoding="utf-8")
+    cacheMetaPath.write_text(json.dumps({
+        "url": listSourceURL,
+        "etag": response.headers.get("ETag"),
+        "lastModified": response.headers.get("Last-Modified")
+    }, indent=2) + "\n")
+    return sourceHTML
+
+# offline: archived source first, then http cache, never the network
+def fetchList(listSourceURL, saveName=None):
+    if offlineMode:
+        archivedSourceHTML = readArchivedSource(saveName) if saveName else None
+        if archivedSourceHTML is not None:
+            return archivedSourceHTML
+        cacheBodyPath, cacheMetaPath = getCachePaths(listSourceURL)
+        if cacheBodyPath.exists():
+            return cacheBodyPath.read_text(encoding="utf-8")
+        raise Exception("No local copy of list available in offline mode: ", listSourceURL)
+    return fetchCached(listSourceURL)
+
+# any edit to this file counts as a parser change for incremental batch runs
+parserHash = hashlib.sha256(Path(__file__).read_bytes()).hexdigest()
+
+def getSourceHash(sourceHTML):
+    return hashlib.sha256(sourceHTML.encode("utf-8")).hexdigest()
+
+# archive/manifest.json records the inputs each archived scrape was built from
+def loadManifest():
+    manifestPath = Path("./archive/manifest.json")
+    return json.loads(manifestPath.read_text()) if manifestPath.exists() else {}
+
+def updateManifest(saveName, sourceHTML):
+    archiveManifest = loadManifest()
+    archiveManifest[saveName] = {
+        "sourceHash": getSourceHash(sourceHTML),
+        "parserHash": parserHash
+    }
+    with open("./archive/manifest.json", "w") as outfile:
+        json.dump(archiveManifest, outfile, indent=2, sort_keys=True)
+        outfile.write("\n")
+
+def isListUnchanged(archiveManifest, listSourceURL, dateISO, saveId, sourceHTML):
+    if forceMode: return False
+    saveName = getSaveName(listSourceURL, dateISO, saveId)
+    manifestEntry = archiveManifest.get(saveName)
+    return (
+        manifestEntry is not None
+        and manifestEntry["sourceHash"] == getSourceHash(sourceHTML)
+        and manifestEntry["parserHash"] == parserHash
+        and hasArchivedScrape(saveName)
+    )
 
 # scrape updates from html source
-def scrapeList(listSourceURL, dateISO):
-    sourceHTML = requests.get(listSourceURL).text
+def scrapeList(listSourceURL, dateISO, saveId=None, stageTimer=None):
+    with stageTimer.stage("fetch") if stageTimer else nullcontext():
+        sourceHTML = fetchList(listSourceURL, getSaveName(listSourceURL, dateISO, saveId) if saveId else None)
+    scrapeJSON = parseList(sourceHTML, listSourceURL, dateISO, stageTimer)
+    return scrapeJSON, sourceHTML
+
+# per-list stage timings; time in a nested stage (e.g., parsing while a streamed write is running) is only counted once
+class StageTimer:
+    def __init__(self, listName):
+        self.record = {"list": listName}
+        self.openStages = [] # child seconds of each open stage
+
+    @contextmanager
+    def stage(self, stageName):
+        stageStart = time.perf_counter()
+        self.openStages.append(0.0)
+        try:
+            yield
+        finally:
+            stageSeconds = time.perf_counter() - stageStart
+            self.add(stageName, stageSeconds - self.openStages.pop())
+            if self.openStages: self.openStages[-1] += stageSeconds
+
+    def add(self, stageName, stageSeconds):
+        self.record[stageName + "Seconds"] = self.record.get(stageName + "Seconds", 0.0) + stageSeconds
+
+    # fold in timings recorded elsewhere, e.g., in a worker process
+    def merge(self, timingRecord):
+        for key, value in timingRecord.items():
+            if key.endswith("Seconds"): self.add(key[:-len("Seconds")], value)
+
+stageTimers = []
+
+def newStageTimer(listName):
+    stageTimers.append(StageTimer(listName))
+    return stageTimers[-1]
+
+# time spent producing each item of a generator counts toward stageName
+def timeIterator(iterable, stageTimer, stageName):
+    iterator = iter(iterable)
+    while True:
+        with stageTimer.stage(stageName):
+            try:
+                item = next(iterator)
+            except StopIteration:
+                return
+        yield item
+
+# tags that never get pushed onto the stack of open tags (same as BeautifulSoup's html.parser tree builder)
+voidTags = {"area", "base", "br", "col", "embed", "hr", "img", "input", "keygen", "link", "menuitem", "meta", "param", "source", "spacer", "track", "wbr", "basefont", "bgsound", "command", "frame", "image", "isindex", "nextid"}
+
+# text in these tags isn't included in BeautifulSoup's get_text()
+hiddenTextTags = {"script", "style", "template"}
+
+# single pass over the html, collecting each "body > table > tr" row as (rowText, hasTable, fieldNum, fieldTxt)
+# without building a tree; nesting follows BeautifulSoup's html.parser tree so output matches the old select() loop
+# fieldNum/fieldTxt come from the first nested "td > table > tr", i.e., its first and last cell
+class ListRowParser(HTMLParser):
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.openTags = []
+        self.rows = []
+        self.rowDepth = None # stack depth of open list row
+        self.innerRowDepth = None # stack depth of first nested tr in list row
+        self.cellDepth = None # stack depth of open cell in first nested tr
+        self.hiddenDepth = None
+
+    def handle_starttag(self, tag, attrs):
+        if tag in voidTags: return
+        openTags = self.openTags
+
+        if self.rowDepth is None:
+            if tag == "tr" and openTags[-2:] == ["body", "table"]:
+                self.rowDepth = len(openTags)
+                self.rowText = []
+                self.rowHasTable = False
+                self.rowCells = None
+        else:
+            if tag == "table":
+                self.rowHasTable = True
+            elif tag == "tr" and self.rowCells is None and len(openTags) >= 2 and openTags[-1] == "table" and openTags[-2] == "td":
+                self.innerRowDepth = len(openTags)
+                self.rowCells = []
+            elif self.innerRowDepth is not None and len(openTags) == self.innerRowDepth + 1:
+                self.cellDepth = len(openTags)
+                self.rowCells.append((tag, []))
+
+        if tag in hiddenTextTags and self.hiddenDepth is None: self.hiddenDepth = len(openTags)
+        openTags.append(tag)
+
+    def handle_endtag(self, tag):
+        openTags = self.openTags
+        for tagDepth in range(len(openTags) - 1, -1, -1):
+            if openTags[tagDepth] == tag:
+                self.popTags(tagDepth)
+                return
+
+    def handle_data(self, data):
+        if self.rowDepth is None or self.hiddenDepth is not None: return
+        self.rowText.append(data)
+        if self.cellDepth is not None: self.rowCells[-1][1].append(data)
+
+    # close tags down to (and including) stack depth, finishing any cell/row that closes with them
+    def popTags(self, tagDepth):
+        del self.openTags[tagDepth:]
+        if self.hiddenDepth is not None and self.hiddenDepth >= tagDepth: self.hiddenDepth = None
+        if self.cellDepth is not None and self.cellDepth >= tagDepth: self.cellDepth = None
+        if self.innerRowDepth is not None and self.innerRowDepth >= tagDepth: self.innerRowDepth = None
+        if self.rowDepth is not None and self.rowDepth >= tagDepth:
+            self.rowDepth = None
+            fieldNum = fieldTxt = None
+            if self.rowCells and self.rowCells[0][0] == "td": fieldNum = "".join(self.rowCells[0][1])
+            if self.rowCells and self.rowCells[-1][0] == "td": fieldTxt = "".join(self.rowCells[-1][1])
+            self.rows.append(("".join(self.rowText), self.rowHasTable, fieldNum, fieldTxt))
+
+    def close(self):
+        super().close()
+        self.popTags(0)
+
+# one compiled pattern for every marker the row loop cares about
+rowMarkerPattern = re.compile(r"GENRE/FORM TERMS|CHILDREN'S SUBJECT HEADINGS|MEDIUM OF PERFORMANCE TERMS|DEMOGRAPHIC GROUP TERMS|CHANGE HEADING|CANCEL HEADING|ADD FIELD|DELETE FIELD|ADD GEOG|DELETE GEOG|CHANGE GEOG|\(A\)|\(C\)")
+
+# feed html in chunks, yielding rows as they close so the full row list is never held
+def iterListRows(sourceHTML, chunkSize=65536):
+    rowParser = ListRowParser()
+    for chunkStart in range(0, len(sourceHTML), chunkSize):
+        rowParser.feed(sourceHTML[chunkStart:chunkStart + chunkSize])
+        yield from rowParser.rows
+        rowParser.rows.clear()
+    rowParser.close()
+    yield from rowParser.rows
+
+def getFieldCells(rowText, fieldNum, fieldTxt):
+    if fieldNum is None or fieldTxt is None: raise Exception("Expected row to contain field number and field text: ", rowText)
+    return squashSpaces(fieldNum), squashSpaces(fieldTxt)
+
+# parse updates from html already in hand (CPU-bound, safe to run in a worker process)
+def parseList(sourceHTML, listSourceURL, dateISO, stageTimer=None):
+    if stageTimer: return list(timeUpdates(sourceHTML, listSourceURL, dateISO, stageTimer))
+    return list(iterUpdates(sourceHTML, listSourceURL, dateISO))
 
-    # can use local html for testing instead
-    # import codecs
-    # sourceHTML = codecs.open("./source.html", "r", "utf-8").read()
+# parseList for worker processes, returning the stage timings alongside the updates
+def parseListTimed(sourceHTML, listSourceURL, dateISO):
+    stageTimer = StageTimer(None)
+    return parseList(sourceHTML, listSourceURL, dateISO, stageTimer), stageTimer.record
 
-    htmlSoup = BeautifulSoup(sourceHTML, 'html.parser')
+# iterUpdates with tokenizing (html -> rows) and classifying (rows -> updates) timed as separate stages
+def timeUpdates(sourceHTML, listSourceURL, dateISO, stageTimer):
+    return timeIterator(iterUpdates(sourceHTML, listSourceURL, dateISO, stageTimer), stageTimer, "classify")
 
-    scrapeJSON = []
+# pass updates through to the writer, building tweet threads and/or summary counts from the same single pass
+# (tweetsJSON and summaryCounts are filled in place, and are complete once the updates have all been written)
+def collectUpdates(updates, tweetsJSON=None, summaryCounts=None, stageTimer=None):
+    for update in updates:
+        if tweetsJSON is not None:
+            with stageTimer.stage("tweets") if stageTimer else nullcontext():
+                tweetsJSON.append(getTweetThread(update))
+        if summaryCounts is not None: addSummaryCounts(summaryCounts, update)
+        yield update
+
+# yield each update as soon as its closing blank row is reached
+def iterUpdates(sourceHTML, listSourceURL, dateISO, stageTimer=None):
+    listInfo = (dateISO, listSourceURL)
     currentHeadingType = "mainSubjectHeading" # LC always starts with this?
     addingUpdate = False
+    listRows = iterListRows(sourceHTML)
+    if stageTimer: listRows = timeIterator(listRows, stageTimer, "tokenize")
 
     # break html table into chunks based on blank rows
-    for tr in htmlSoup.select("body > table > tr"):
+    for rowText, rowHasTable, rowFieldNum, rowFieldTxt in listRows:
+        rowMarkers = set(rowMarkerPattern.findall(rowText))
+
         # detect subject heading type based on page section titles
-        if "GENRE/FORM TERMS" in tr.text: currentHeadingType = "genreFormTerm"
-        if "CHILDREN'S SUBJECT HEADINGS" in tr.text: currentHeadingType = "childrensSubjectHeading"
-        if "MEDIUM OF PERFORMANCE TERMS" in tr.text: currentHeadingType = "mediumOfPerformanceTerm"
-        if "DEMOGRAPHIC GROUP TERMS" in tr.text: currentHeadingType = "demographicGroupTerm"
+        if "GENRE/FORM TERMS" in rowMarkers: currentHeadingType = "genreFormTerm"
+        if "CHILDREN'S SUBJECT HEADINGS" in rowMarkers: currentHeadingType = "childrensSubjectHeading"
+        if "MEDIUM OF PERFORMANCE TERMS" in rowMarkers: currentHeadingType = "mediumOfPerformanceTerm"
+        if "DEMOGRAPHIC GROUP TERMS" in rowMarkers: currentHeadingType = "demographicGroupTerm"
 
         # detect heading, fields, geog updates
-        changeHeadingLine = True if "CHANGE HEADING" in tr.text else False
-        cancelHeadingLine = True if "CANCEL HEADING" in tr.text else False
-        addFieldLine = True if "ADD FIELD" in tr.text else False
-        deleteFieldLine = True if "DELETE FIELD" in tr.text else False
-        addGeogLine = True if "ADD GEOG" in tr.text else False
-        deleteGeogLine = True if "DELETE GEOG" in tr.text else False
-        changeGeogLine = True if "CHANGE GEOG" in tr.text else False
+        changeHeadingLine = "CHANGE HEADING" in rowMarkers
+        cancelHeadingLine = "CANCEL HEADING" in rowMarkers
+        addFieldLine = "ADD FIELD" in rowMarkers
+        deleteFieldLine = "DELETE FIELD" in rowMarkers
+        addGeogLine = "ADD GEOG" in rowMarkers
+        deleteGeogLine = "DELETE GEOG" in rowMarkers
+        changeGeogLine = "CHANGE GEOG" in rowMarkers
 
         # detect (A) and (C)
-        approvedBeforeMeetingLine = True if "(A)" in tr.text else False
-        submittedByCoopLibLine = True if "(C)" in tr.text else False
+        approvedBeforeMeetingLine = "(A)" in rowMarkers
+        submittedByCoopLibLine = "(C)" in rowMarkers
 
         if not addingUpdate:
-            if tr.select_one("table"): # beginning new update, first line (1xx)
+            if rowHasTable: # beginning new update, first line (1xx)
                 addingUpdate = True
-                newUpdate = newUpdateObj(currentHeadingType, dateISO, listSourceURL)
+                newUpdate = newUpdateObj(currentHeadingType, listInfo)
 
                 # set (A) and (C)
                 if approvedBeforeMeetingLine: newUpdate["statusApprovedBeforeMeeting"] = True
                 if submittedByCoopLibLine: newUpdate["statusSubmittedByCoopLib"] = True
 
-                fieldNum = squashSpaces(tr.select_one("td > table > tr > td:first-child").get_text())
-                fieldTxt = squashSpaces(tr.select_one("td > table > tr > td:last-child").get_text())
+                fieldNum, fieldTxt = getFieldCells(rowText, rowFieldNum, rowFieldTxt)
                 if fieldNum[0] != "1": raise Exception("Expected update to start with 1xx, instead: ", fieldNum)
                 if changeHeadingLine: # 1xx for changed heading; represents old heading
                     newUpdate["statusChangedHeading"] = True
@@ -228,9 +942,8 @@ def scrapeList(listSourceURL, dateISO):
             else: # blank rows
                 continue
         else:
-            if tr.select_one("table"): # adding update lines
-                fieldNum = squashSpaces(tr.select_one("td > table > tr > td:first-child").get_text())
-                fieldTxt = squashSpaces(tr.select_one("td > table > tr > td:last-child").get_text())
+            if rowHasTable: # adding update lines
+                fieldNum, fieldTxt = getFieldCells(rowText, rowFieldNum, rowFieldTxt)
                 if fieldNum[0] == "1": # 1xx after changed heading; represents new heading
                     if addGeogLine or deleteGeogLine or changeGeogLine:
                         newUpdate["statusUpdatedGeog"] = True
@@ -251,8 +964,7 @@ def scrapeList(listSourceURL, dateISO):
             else: # first blank row after update
                 addingUpdate = False
                 if not (newUpdate["statusChangedHeading"] or newUpdate["statusCancelledHeading"] or newUpdate["statusUpdatedField"] or newUpdate["statusUpdatedGeog"]): newUpdate["statusNewHeading"] = True
-                scrapeJSON.append(newUpdate)
-    return scrapeJSON, sourceHTML
+                yield newUpdate
 
     # NOTES RE: OBSERVED LC CONVENTIONS
     # CHANGE HEADING always on first line with old heading; update never (?) includes by ADD/DELETE FIELD; update sometimes (rarely) includes ADD/DELETE GEOG (on second with new heading)
@@ -261,182 +973,1129 @@ def scrapeList(listSourceURL, dateISO):
     # ADD/DELETE/CHANGE GEOG usually first line; sometimes (rarely) on second line if first line includes CHANGE HEADING; sometimes (rarely) update includes only ADD/DELETECHANGE GEOG with no other field updates
     # total updates = new headings + changed headings (includes some ADD/DELETE/CHANGE GEOG) + cancelled headings + updated fields (includes all ADD/DELETE fields and some ADD/DELETE/CHANGE GEOG)
 
-def toTwitterJSON(scrapeJSON):
-    # generate tweet threads from updates
-    tweetsJSON = []
-    for update in scrapeJSON:
-        if update["headingType"] == "mainSubjectHeading": hashtags = "-newLCSH"
-        if update["headingType"] == "genreFormTerm": hashtags = "-newLCGFT"
-        if update["headingType"] == "childrensSubjectHeading": hashtags = "-newLCSHAC"
-        if update["headingType"] == "mediumOfPerformanceTerm": hashtags = "-newLCMPT"
-        if update["headingType"] == "demographicGroupTerm": hashtags = "-newLCDGT"
-
-        if update["statusNewHeading"]:
-            intro = "NEW HEADING"
-            hashtags += " -newHeading"
-
-        if update["statusChangedHeading"]:
-            intro = "CHANGE HEADING"
-            hashtags += " -changedHeading"
-
-        if update["statusCancelledHeading"]:
-            intro = "CANCEL HEADING"
-            hashtags += " -cancelledHeading"
-
-        if update["statusUpdatedField"] or update["statusUpdatedGeog"]:
-            intro = "UPDATE DETAILS" if not update["statusChangedHeading"] else "CHANGE HEADING"
-            if update["statusUpdatedField"]: hashtags += " -updatedField"
-            if update["statusUpdatedGeog"]: hashtags += " -updatedGeog"
-
-        tweetThread = []
-        tweetBody = ""
-        for index, line in enumerate(update["lines"]):
-            # first 1-2 heading-related lines = stanalone tweets
-            if index == 0:
-                lineStripped = stripHeadingStatus(line) if update["statusNewHeading"] or update["statusChangedHeading"] else line
-                tweetThread.append(f"{intro} ⇨\n{lineStripped}\n\n{hashtags}")
-            elif index == 1 and update["statusChangedHeading"]:
-                tweetThread.append(f"NEW HEADING (CHANGED) →\n{line}")
-            else:
-                # concatenate any remaining lines as tweetBody
-                if tweetBody == "":
-                    tweetBody += line
-                else:
-                    tweetBody += "\n\n" + line
-
-        # break tweetBody into 280-character chunks (occasionally no tweetBody due to single-line updates)
-        if tweetBody:
-            maxLen = 274 # 280 minus 6 for possible leading/trailing "..."
-
-            # for Tweets containing special double-weighted characters, reduce max chunk size to accomodate
-            numSpecials = countSpecialCharacters(tweetBody)
-            maxLenAdjusted = maxLen - numSpecials
-            tweetBodyChunks = textwrap.wrap(tweetBody, width=maxLenAdjusted, replace_whitespace=False, break_on_hyphens=False)
-
-            if len(tweetBodyChunks) == 1:
-                tweetThread.append(tweetBodyChunks[0])
-            else:
-                tweetThread.append(tweetBodyChunks[0] + "...")
-                for chunk in tweetBodyChunks[1:-1]:
-                    tweetThread.append("..." + chunk + "...")
-                tweetThread.append("..." + tweetBodyChunks[-1])
-
-        # TODO: warn re: inactive links for cancelled headings?
-        datePretty = getPrettyDate(update["listDate"])
-        listSourceURL = update["listSource"]
-        if update["headingType"] not in ["demographicGroupTerm", "mediumOfPerformanceTerm"]:
-            tweetThread.append(f"🗓️ Approved {datePretty} →\n{listSourceURL}\n\n🌐 LC Linked Data Service URI →\n{update['LCLinkedDataURI']}\n\n🔗 LCCN Permalink →\n{update['LCCNPermalink']}\n\n*Links might not be active for very recently approved subject headings")
+# tweet thread for one update
+def getTweetThread(update):
+    if update["headingType"] == "mainSubjectHeading": hashtags = "-newLCSH"
+    if update["headingType"] == "genreFormTerm": hashtags = "-newLCGFT"
+    if update["headingType"] == "childrensSubjectHeading": hashtags = "-newLCSHAC"
+    if update["headingType"] == "mediumOfPerformanceTerm": hashtags = "-newLCMPT"
+    if update["headingType"] == "demographicGroupTerm": hashtags = "-newLCDGT"
+
+    if update["statusNewHeading"]:
+        intro = "NEW HEADING"
+        hashtags += " -newHeading"
+
+    if update["statusChangedHeading"]:
+        intro = "CHANGE HEADING"
+        hashtags += " -changedHeading"
+
+    if update["statusCancelledHeading"]:
+        intro = "CANCEL HEADING"
+        hashtags += " -cancelledHeading"
+
+    if update["statusUpdatedField"] or update["statusUpdatedGeog"]:
+        intro = "UPDATE DETAILS" if not update["statusChangedHeading"] else "CHANGE HEADING"
+        if update["statusUpdatedField"]: hashtags += " -updatedField"
+        if update["statusUpdatedGeog"]: hashtags += " -updatedGeog"
+
+    tweetThread = []
+    tweetBody = ""
+    for index, line in enumerate(update["lines"]):
+        # first 1-2 heading-related lines = stanalone tweets
+        if index == 0:
+            lineStripped = stripHeadingStatus(line) if update["statusNewHeading"] or update["statusChangedHeading"] else line
+            tweetThread.append(f"{intro} ⇨\n{lineStripped}\n\n{hashtags}")
+        elif index == 1 and update["statusChangedHeading"]:
+            tweetThread.append(f"NEW HEADING (CHANGED) →\n{line}")
         else:
-            tweetThread.append(f"🗓️ Approved {datePretty} →\n{listSourceURL}\n\n🌐 LC Linked Data Service URI →\n{update['LCLinkedDataURI']}\n\n*Links might not be active for very recently approved subject headings")
+            # concatenate any remaining lines as tweetBody
+            if tweetBody == "":
+                tweetBody += line
+            else:
+                tweetBody += "\n\n" + line
+
+    # break tweetBody into 280-weight chunks (occasionally no tweetBody due to single-line updates)
+    if tweetBody:
+        tweetThread += splitTweetBody(tweetBody)
+
+    # TODO: warn re: inactive links for cancelled headings?
+    datePretty = getPrettyDate(update["listDate"])
+    listSourceURL = update["listSource"]
+    if update["headingType"] not in ["demographicGroupTerm", "mediumOfPerformanceTerm"]:
+        tweetThread.append(f"🗓️ Approved {datePretty} →\n{listSourceURL}\n\n🌐 LC Linked Data Service URI →\n{update['LCLinkedDataURI']}\n\n🔗 LCCN Permalink →\n{update['LCCNPermalink']}\n\n*Links might not be active for very recently approved subject headings")
+    else:
+        tweetThread.append(f"🗓️ Approved {datePretty} →\n{listSourceURL}\n\n🌐 LC Linked Data Service URI →\n{update['LCLinkedDataURI']}\n\n*Links might not be active for very recently approved subject headings")
+
+    return tweetThread
+
+# generate tweet threads from updates
+def toTwitterJSON(scrapeJSON):
+    return [getTweetThread(update) for update in scrapeJSON]
 
-        tweetsJSON.append(tweetThread)
-    return tweetsJSON
+# zeroed counts for everything printSummary reports
+def newSummaryCounts():
+    summaryCounts = dict.fromkeys([
+        "total", "approvedBeforeMeeting", "submittedByCoopLib",
+        "mainSubjectHeading", "genreFormTerm", "childrensSubjectHeading", "mediumOfPerformanceTerm", "demographicGroupTerm",
+        "newHeading", "changedHeading", "changedHeadingAddedGeog", "changedHeadingDeletedGeog", "changedHeadingChangedGeog",
+        "cancelledHeading", "otherChanges", "addedField", "deletedField", "otherAddedGeog", "otherDeletedGeog", "otherChangedGeog",
+        "longestHeadingLen"
+    ], 0)
+    summaryCounts["longestHeadingTxt"] = ""
+    return summaryCounts
+
+# add one update to the counts
+def addSummaryCounts(summaryCounts, update):
+    statusFlags = update.statusFlags
+    changedHeading = statusFlags & updateStatusBits["statusChangedHeading"]
+
+    summaryCounts["total"] += 1
+    summaryCounts[update.headingType] += 1
+    if statusFlags & updateStatusBits["statusApprovedBeforeMeeting"]: summaryCounts["approvedBeforeMeeting"] += 1
+    if statusFlags & updateStatusBits["statusSubmittedByCoopLib"]: summaryCounts["submittedByCoopLib"] += 1
+    if statusFlags & updateStatusBits["statusNewHeading"]: summaryCounts["newHeading"] += 1
+    if statusFlags & updateStatusBits["statusCancelledHeading"]: summaryCounts["cancelledHeading"] += 1
+    if statusFlags & updateStatusBits["statusAddedField"]: summaryCounts["addedField"] += 1
+    if statusFlags & updateStatusBits["statusDeletedField"]: summaryCounts["deletedField"] += 1
+    if changedHeading:
+        summaryCounts["changedHeading"] += 1
+        if statusFlags & updateStatusBits["statusAddedGeog"]: summaryCounts["changedHeadingAddedGeog"] += 1
+        if statusFlags & updateStatusBits["statusDeletedGeog"]: summaryCounts["changedHeadingDeletedGeog"] += 1
+        if statusFlags & updateStatusBits["statusChangedGeog"]: summaryCounts["changedHeadingChangedGeog"] += 1
+    else:
+        if statusFlags & updateStatusBits["statusAddedGeog"]: summaryCounts["otherAddedGeog"] += 1
+        if statusFlags & updateStatusBits["statusDeletedGeog"]: summaryCounts["otherDeletedGeog"] += 1
+        if statusFlags & updateStatusBits["statusChangedGeog"]: summaryCounts["otherChangedGeog"] += 1
+    if statusFlags & updateStatusBits["statusUpdatedField"] or (statusFlags & updateStatusBits["statusUpdatedGeog"] and not changedHeading):
+        summaryCounts["otherChanges"] += 1
+
+    headerTxt = update.lines[0]
+    if len(headerTxt) > summaryCounts["longestHeadingLen"]:
+        summaryCounts["longestHeadingLen"] = len(headerTxt)
+        summaryCounts["longestHeadingTxt"] = headerTxt
+
+# tally everything printSummary reports in one pass over the updates
+def getSummaryCounts(scrapeJSON):
+    summaryCounts = newSummaryCounts()
+    for update in scrapeJSON:
+        addSummaryCounts(summaryCounts, update)
+    return summaryCounts
 
 def printSummary(scrapeJSON):
-    maxLen, maxTxt = getLongestHeading(scrapeJSON)
+    printSummaryCounts(getSummaryCounts(scrapeJSON))
+
+def printSummaryCounts(summaryCounts):
     print(
         "",
         "-----------------------------------",
-        f"TOTAL UPDATES:                {len(scrapeJSON):>5}",
+        f"TOTAL UPDATES:                {summaryCounts['total']:>5}",
         "-----------------------------------",
-        f"Approved before meeting (A):  {len([update for update in scrapeJSON if update['statusApprovedBeforeMeeting']]):>5}",
-        f"Submitted by coop. lib. (C):  {len([update for update in scrapeJSON if update['statusSubmittedByCoopLib']]):>5}",
+        f"Approved before meeting (A):  {summaryCounts['approvedBeforeMeeting']:>5}",
+        f"Submitted by coop. lib. (C):  {summaryCounts['submittedByCoopLib']:>5}",
         "-----------------------------------",
-        f"Main subject headings:        {len([update for update in scrapeJSON if update['headingType'] == 'mainSubjectHeading']):>5}",
-        f"Genre/form terms:             {len([update for update in scrapeJSON if update['headingType'] == 'genreFormTerm']):>5}",
-        f"Children's subject headings:  {len([update for update in scrapeJSON if update['headingType'] == 'childrensSubjectHeading']):>5}",
-        f"Medium of performance terms:  {len([update for update in scrapeJSON if update['headingType'] == 'mediumOfPerformanceTerm']):>5}",
-        f"Demographic group terms:      {len([update for update in scrapeJSON if update['headingType'] == 'demographicGroupTerm']):>5}",
+        f"Main subject headings:        {summaryCounts['mainSubjectHeading']:>5}",
+        f"Genre/form terms:             {summaryCounts['genreFormTerm']:>5}",
+        f"Children's subject headings:  {summaryCounts['childrensSubjectHeading']:>5}",
+        f"Medium of performance terms:  {summaryCounts['mediumOfPerformanceTerm']:>5}",
+        f"Demographic group terms:      {summaryCounts['demographicGroupTerm']:>5}",
         "-----------------------------------",
-        f"New headings:                 {len([update for update in scrapeJSON if update['statusNewHeading']]):>5}",
-        f"Changed headings:             {len([update for update in scrapeJSON if update['statusChangedHeading']]):>5}",
-        f"├──With added geog:           {len([update for update in scrapeJSON if (update['statusAddedGeog'] and update['statusChangedHeading'])]):>5}",
-        f"├──With deleted geog:         {len([update for update in scrapeJSON if (update['statusDeletedGeog'] and update['statusChangedHeading'])]):>5}",
-        f"└──With changed geog:         {len([update for update in scrapeJSON if (update['statusChangedGeog'] and update['statusChangedHeading'])]):>5}",
-        f"Cancelled headings:           {len([update for update in scrapeJSON if update['statusCancelledHeading']]):>5}",
-        f"Other changes:                {len([update for update in scrapeJSON if (update['statusUpdatedField'] or update['statusUpdatedGeog'] and not update['statusChangedHeading'])]):>5}",
-        f"├──With added field(s):       {len([update for update in scrapeJSON if update['statusAddedField']]):>5}",
-        f"├──With deleted field(s):     {len([update for update in scrapeJSON if update['statusDeletedField']]):>5}",
-        f"├──With added geog:           {len([update for update in scrapeJSON if (update['statusAddedGeog'] and not update['statusChangedHeading'])]):>5}",
-        f"├──With deleted geog:         {len([update for update in scrapeJSON if (update['statusDeletedGeog'] and not update['statusChangedHeading'])]):>5}",
-        f"└──With changed geog:         {len([update for update in scrapeJSON if (update['statusChangedGeog'] and not update['statusChangedHeading'])]):>5}",
+        f"New headings:                 {summaryCounts['newHeading']:>5}",
+        f"Changed headings:             {summaryCounts['changedHeading']:>5}",
+        f"├──With added geog:           {summaryCounts['changedHeadingAddedGeog']:>5}",
+        f"├──With deleted geog:         {summaryCounts['changedHeadingDeletedGeog']:>5}",
+        f"└──With changed geog:         {summaryCounts['changedHeadingChangedGeog']:>5}",
+        f"Cancelled headings:           {summaryCounts['cancelledHeading']:>5}",
+        f"Other changes:                {summaryCounts['otherChanges']:>5}",
+        f"├──With added field(s):       {summaryCounts['addedField']:>5}",
+        f"├──With deleted field(s):     {summaryCounts['deletedField']:>5}",
+        f"├──With added geog:           {summaryCounts['otherAddedGeog']:>5}",
+        f"├──With deleted geog:         {summaryCounts['otherDeletedGeog']:>5}",
+        f"└──With changed geog:         {summaryCounts['otherChangedGeog']:>5}",
         "-----------------------------------",
-        f"Longest heading ({maxLen} chr):",
-        f"{maxTxt[:32]}...",
+        f"Longest heading ({summaryCounts['longestHeadingLen']} chr):",
+        f"{summaryCounts['longestHeadingTxt'][:32]}...",
         "-----------------------------------",
         "",
         sep="\n"
     )
 
-def saveFiles(listSourceURL, dateISO, saveId, scrapeJSON, sourceHTML, tweetsJSON=None):
+# write updates (list or generator) one at a time; pretty JSON output is byte-identical to json.dump(..., indent=2)
+# returns the number of updates written
+def writeUpdates(updates, outfile, updateFormat=None):
+    updateCount = 0
+    if (updateFormat or outputFormat) == "ndjson":
+        for update in updates:
+            outfile.write(json.dumps(update.toDict(), ensure_ascii=False) + "\n")
+            updateCount += 1
+        return updateCount
+
+    separator = "[\n  "
+    for update in updates:
+        outfile.write(separator + json.dumps(update.toDict(), indent=2, ensure_ascii=False).replace("\n", "\n  "))
+        separator = ",\n  "
+        updateCount += 1
+    outfile.write("[]\n" if separator == "[\n  " else "\n]\n") # ensure newline at EOF for POSIX compliance
+    return updateCount
+
+# archive/index.sqlite indexes every archived update by record ID, URI, heading type, status and date, with FTS on lines
+def openIndex():
+    indexConnection = sqlite3.connect("./archive/index.sqlite")
+    indexConnection.executescript("""
+        CREATE TABLE IF NOT EXISTS lists (saveName TEXT PRIMARY KEY, scrapeHash TEXT NOT NULL, scrapeStat TEXT);
+        CREATE TABLE IF NOT EXISTS updates (
+            updateId INTEGER PRIMARY KEY,
+            saveName TEXT NOT NULL,
+            listDate TEXT NOT NULL,
+            listSource TEXT NOT NULL,
+            recordId TEXT,
+            headingType TEXT NOT NULL,
+            LCLinkedDataURI TEXT,
+            LCCNPermalink TEXT,
+            statusFlags INTEGER NOT NULL,
+            lines TEXT NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS updatesBySaveName ON updates (saveName);
+        CREATE INDEX IF NOT EXISTS updatesByRecordId ON updates (recordId);
+        CREATE INDEX IF NOT EXISTS updatesByURI ON updates (LCLinkedDataURI);
+        CREATE INDEX IF NOT EXISTS updatesByHeadingType ON updates (headingType);
+        CREATE INDEX IF NOT EXISTS updatesByListDate ON updates (listDate);
+        CREATE VIRTUAL TABLE IF NOT EXISTS updatesText USING fts5 (lines);
+        CREATE TABLE IF NOT EXISTS history (recordId TEXT PRIMARY KEY, LCLinkedDataURI TEXT, events TEXT NOT NULL);
+        CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT);
+    """)
+    # indexes built before scrapeStat was added get it as an empty column (those lists are hashed once, then stat-checked)
+    if "scrapeStat" not in [column[1] for column in indexConnection.execute("PRAGMA table_info(lists)")]:
+        indexConnection.execute("ALTER TABLE lists ADD COLUMN scrapeStat TEXT")
+    return indexConnection
+
+# e.g., http://id.loc.gov/authorities/subjects/sh85003553 -> sh85003553
+def getRecordId(update):
+    return update["LCLinkedDataURI"].rsplit("/", 1)[-1] if update["LCLinkedDataURI"] else None
+
+# (re)index one archived scrape, skipped if its contents haven't changed since it was last indexed
+def indexArchivedList(indexConnection, saveName, scrapeStat=None):
+    if scrapeStat is None: scrapeStat = getArchivedScrapeStat(saveName)
+    scrapeHash = getArchivedScrapeHash(saveName)
+    indexedList = indexConnection.execute("SELECT scrapeHash FROM lists WHERE saveName = ?", (saveName,)).fetchone()
+    if indexedList and indexedList[0] == scrapeHash:
+        # same contents (e.g., rewritten unchanged by a rescrape), so only the stat is out of date
+        with indexConnection:
+            indexConnection.execute("UPDATE lists SET scrapeStat = ? WHERE saveName = ?", (scrapeStat, saveName))
+        return False
+
+    with indexConnection:
+        removeIndexedList(indexConnection, saveName)
+        for update in iterArchivedUpdates(saveName):
+            updateCursor = indexConnection.execute(
+                "INSERT INTO updates (saveName, listDate, listSource, recordId, headingType, LCLinkedDataURI, LCCNPermalink, statusFlags, lines) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (saveName, update["listDate"], update["listSource"], getRecordId(update), update.headingType, update.LCLinkedDataURI, update.LCCNPermalink, update.statusFlags, json.dumps(update.lines, ensure_ascii=False))
+            )
+            indexConnection.execute("INSERT INTO updatesText (rowid, lines) VALUES (?, ?)", (updateCursor.lastrowid, "\n".join(update.lines)))
+        indexConnection.execute("INSERT INTO lists (saveName, scrapeHash, scrapeStat) VALUES (?, ?, ?)", (saveName, scrapeHash, scrapeStat))
+    return True
+
+def removeIndexedList(indexConnection, saveName):
+    indexConnection.execute("DELETE FROM updatesText WHERE rowid IN (SELECT updateId FROM updates WHERE saveName = ?)", (saveName,))
+    indexConnection.execute("DELETE FROM updates WHERE saveName = ?", (saveName,))
+    indexConnection.execute("DELETE FROM lists WHERE saveName = ?", (saveName,))
+
+# bring the index in line with the archive, only touching lists that were added, changed or removed
+# (lists are compared by stat first, so an unchanged archive isn't read at all)
+def updateIndex(indexConnection):
+    storeRefs = loadStoreRefs() if archiveStoreMode else None
+    archivedNames = set(getArchivedNames())
+    indexedStats = dict(indexConnection.execute("SELECT saveName, scrapeStat FROM lists").fetchall())
+    for saveName in sorted(archivedNames):
+        scrapeStat = getArchivedScrapeStat(saveName, storeRefs)
+        if indexedStats.get(saveName) != scrapeStat: indexArchivedList(indexConnection, saveName, scrapeStat)
+    for saveName in indexedStats:
+        if saveName not in archivedNames:
+            with indexConnection:
+                removeIndexedList(indexConnection, saveName)
+
+# short names for --status, e.g., --status cancelled
+queryStatusKeys = {
+    "new": "statusNewHeading",
+    "changed": "statusChangedHeading",
+    "cancelled": "statusCancelledHeading",
+    "field": "statusUpdatedField",
+    "geog": "statusUpdatedGeog",
+    "A": "statusApprovedBeforeMeeting",
+    "C": "statusSubmittedByCoopLib"
+}
+
+# text is an FTS5 query over lines; date bounds match by prefix so --to 2022-03 includes 2022-03-15
+def queryIndex(indexConnection, text=None, recordId=None, headingType=None, status=None, fromDate=None, toDate=None, ftsSyntax=False):
+    queryClauses, queryParams = [], []
+    if text:
+        queryClauses.append("updateId IN (SELECT rowid FROM updatesText WHERE updatesText MATCH ?)")
+        # text is matched as a phrase unless ftsSyntax, since headings are full of characters FTS5 treats as operators (e.g., - and parentheses)
+        queryParams.append(text if ftsSyntax else '"' + text.replace('"', '""') + '"')
+    if recordId:
+        queryClauses.append("(recordId = ? OR LCLinkedDataURI = ?)")
+        queryParams += [recordId, recordId]
+    if headingType:
+        queryClauses.append("headingType = ?")
+        queryParams.append(headingType)
+    if status:
+        statusKey = queryStatusKeys.get(status, status)
+        if statusKey not in updateStatusBits: raise Exception("Unknown status: ", status)
+        queryClauses.append("statusFlags & ? != 0")
+        queryParams.append(updateStatusBits[statusKey])
+    if fromDate:
+        queryClauses.append("listDate >= ?")
+        queryParams.append(fromDate)
+    if toDate:
+        queryClauses.append("substr(listDate, 1, length(?)) <= ?")
+        queryParams += [toDate, toDate]
+
+    querySQL = "SELECT headingType, listDate, listSource, LCLinkedDataURI, LCCNPermalink, statusFlags, lines FROM updates"
+    if queryClauses: querySQL += " WHERE " + " AND ".join(queryClauses)
+    querySQL += " ORDER BY listDate, saveName, updateId"
+
+    try:
+        queryRows = indexConnection.execute(querySQL, queryParams)
+    except sqlite3.OperationalError as error:
+        if text and ftsSyntax: raise Exception("Invalid full-text query (FTS5 syntax): ", text, str(error))
+        raise
+    for headingType, listDate, listSource, LCLinkedDataURI, LCCNPermalink, statusFlags, lines in queryRows:
+        update = UpdateRecord(headingType, (listDate, listSource))
+        update.LCLinkedDataURI = LCLinkedDataURI
+        update.LCCNPermalink = LCCNPermalink
+        update.statusFlags = statusFlags
+        update.lines = json.loads(lines)
+        yield update
+
+# heading history: every record's updates across all lists, in list order (new -> changed -> updated -> cancelled)
+def getHistoryEvent(update, saveName):
+    if update["statusNewHeading"]: eventType = "new"
+    elif update["statusChangedHeading"]: eventType = "changed"
+    elif update["statusCancelledHeading"]: eventType = "cancelled"
+    elif update["statusUpdatedField"]: eventType = "updatedField"
+    else: eventType = "updatedGeog"
+
+    historyEvent = {"listDate": update["listDate"], "list": saveName, "event": eventType}
+    if eventType == "changed":
+        historyEvent["previousHeading"] = stripHeadingStatus(update.lines[0])
+        historyEvent["heading"] = update.lines[1]
+    else:
+        historyEvent["heading"] = stripHeadingStatus(update.lines[0])
+    return historyEvent
+
+# fingerprint of everything indexed; history is rebuilt only when this changes
+def getIndexFingerprint(indexConnection):
+    indexedLists = indexConnection.execute("SELECT saveName, scrapeHash FROM lists ORDER BY saveName").fetchall()
+    return hashlib.sha256(json.dumps(indexedLists).encode("utf-8")).hexdigest()
+
+# one linear pass over the index in list order, grouping events by record
+def buildHistory(indexConnection):
+    recordHistories = {}
+    for saveName, LCLinkedDataURI, recordId, headingType, listDate, listSource, statusFlags, lines in indexConnection.execute(
+        "SELECT saveName, LCLinkedDataURI, recordId, headingType, listDate, listSource, statusFlags, lines FROM updates WHERE recordId IS NOT NULL ORDER BY listDate, saveName, updateId"
+    ):
+        update = UpdateRecord(headingType, (listDate, listSource))
+        update.statusFlags = statusFlags
+        update.lines = json.loads(lines)
+        recordHistory = recordHistories.setdefault(recordId, (LCLinkedDataURI, []))
+        recordHistory[1].append(getHistoryEvent(update, saveName))
+
+    with indexConnection:
+        indexConnection.execute("DELETE FROM history")
+        indexConnection.executemany(
+            "INSERT INTO history (recordId, LCLinkedDataURI, events) VALUES (?, ?, ?)",
+            ((recordId, LCLinkedDataURI, json.dumps(events, ensure_ascii=False, separators=(",", ":"))) for recordId, (LCLinkedDataURI, events) in recordHistories.items())
+        )
+        indexConnection.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('historyFingerprint', ?)", (getIndexFingerprint(indexConnection),))
+
+def updateHistory(indexConnection):
+    historyFingerprint = indexConnection.execute("SELECT value FROM meta WHERE key = 'historyFingerprint'").fetchone()
+    if not historyFingerprint or historyFingerprint[0] != getIndexFingerprint(indexConnection):
+        buildHistory(indexConnection)
+
+# record IDs without a URI, e.g., sh85003553, or the LC Linked Data URI itself
+def getRecordHistory(indexConnection, recordId):
+    recordHistory = indexConnection.execute("SELECT recordId, LCLinkedDataURI, events FROM history WHERE recordId = ? OR LCLinkedDataURI = ?", (recordId, recordId)).fetchone()
+    if not recordHistory: return None
+    return {"recordId": recordHistory[0], "LCLinkedDataURI": recordHistory[1], "events": json.loads(recordHistory[2])}
+
+# write every record's history as a JSON array, one record at a time
+def exportHistory(indexConnection, outfile):
+    separator = "[\n  "
+    for recordId, LCLinkedDataURI, events in indexConnection.execute("SELECT recordId, LCLinkedDataURI, events FROM history ORDER BY recordId"):
+        recordHistory = {"recordId": recordId, "LCLinkedDataURI": LCLinkedDataURI, "events": json.loads(events)}
+        outfile.write(separator + json.dumps(recordHistory, ensure_ascii=False))
+        separator = ",\n  "
+    outfile.write("[]\n" if separator == "[\n  " else "\n]\n")
+
+# record a saved list in archive/batch.json, so batch runs rescrape it and watch mode doesn't pick it up again
+def appendBatchRun(listSourceURL, dateISO, saveId):
+    with open("./archive/batch.json", "r+") as batchFile:
+        newRun = {
+            "id": saveId,
+            "date": dateISO,
+            "url": listSourceURL
+        }
+
+        archiveBatch = json.load(batchFile)
+        archiveBatch.append(newRun)
+        batchFile.seek(0)
+        json.dump(archiveBatch, batchFile, indent=2)
+        batchFile.write("\n")
+
+# scrapeJSON may be a generator (e.g., from timeUpdates), in which case parsing happens during the write
+def saveFiles(listSourceURL, dateISO, saveId, scrapeJSON, sourceHTML, tweetsJSON=None, stageTimer=None):
+    if stageTimer is None: stageTimer = StageTimer(None)
     if saveId:
-        listSourceFilename = Path(listSourceURL).stem # kind of misusing Path module, maybe
-        outputFilenameHTML = f"{saveId}--{dateISO}--{listSourceFilename}" + ".html"
-        outputFilenameJSON = f"{saveId}--{dateISO}--{listSourceFilename}" + ".json"
+        outputFilenameJSON = getSaveName(listSourceURL, dateISO, saveId) + ".json"
 
-        if not Path("./archive/source/").exists(): Path("./archive/source/").mkdir(parents=True)
-        with open("./archive/source/" + outputFilenameHTML, "w") as outfile:
-            outfile.write(sourceHTML)
+        with stageTimer.stage("write"):
+            stageTimer.record["updates"] = writeArchivedList(getSaveName(listSourceURL, dateISO, saveId), sourceHTML, scrapeJSON)
 
-        if not Path("./archive/scrape/").exists(): Path("./archive/scrape/").mkdir(parents=True)
-        with open("./archive/scrape/" + outputFilenameJSON, "w") as outfile:
-            json.dump(scrapeJSON, outfile, indent=2, ensure_ascii=False)
-            outfile.write("\n") # here and below: ensure newline at EOFfor POSIX compliance
+        with stageTimer.stage("index"):
+            indexConnection = openIndex()
+            indexArchivedList(indexConnection, getSaveName(listSourceURL, dateISO, saveId))
+            indexConnection.close()
 
         if saveRunMode:
-            with open("./archive/batch.json", "r+") as batchFile:
-                newRun = {
-                    "id": saveId,
-                    "date": dateISO,
-                    "url": listSourceURL
-                }
-
-                archiveBatch = json.load(batchFile)
-                archiveBatch.append(newRun)
-                batchFile.seek(0)
-                json.dump(archiveBatch, batchFile, indent=2)
-                batchFile.write("\n")
+            appendBatchRun(listSourceURL, dateISO, saveId)
 
+        updateManifest(getSaveName(listSourceURL, dateISO, saveId), sourceHTML)
 
         if not skipTweetsMode:
-            s3 = boto3.resource("s3") # use AWS CLI to configure local security credentials
-            tweetsObj = s3.Object("lc-new-subjects", "input/" + outputFilenameJSON)
-            tweetsObj.put(Body=(json.dumps(tweetsJSON, indent=2, default=str, ensure_ascii=False)), ContentType="application/json")
-            print(f"[Saved {outputFilenameJSON} to lc-new-subjects bucket]\n")
+            publishTweets(outputFilenameJSON, tweetsJSON, stageTimer)
     else:
-        if not Path("./output/").exists(): Path("./output/").mkdir()
-        with open("./output/source.html", "w") as outfile:
-            outfile.write(sourceHTML)
+        with stageTimer.stage("write"):
+            if not Path("./output/").exists(): Path("./output/").mkdir()
+            with open("./output/source.html", "w") as outfile:
+                outfile.write(sourceHTML)
 
-        with open("./output/scrape.json", "w") as outfile:
-            json.dump(scrapeJSON, outfile, indent=2, ensure_ascii=False)
-            outfile.write("\n")
+            with open("./output/" + getScrapeFilename("scrape"), "w") as outfile:
+                stageTimer.record["updates"] = writeUpdates(scrapeJSON, outfile)
 
-        with open("./output/tweets.json", "w") as outfile:
-            json.dump(tweetsJSON, outfile, indent=2, ensure_ascii=False)
-            outfile.write("\n")
+            with open("./output/tweets.json", "w") as outfile:
+                json.dump(tweetsJSON, outfile, indent=2, ensure_ascii=False)
+                outfile.write("\n") # ensure newline at EOF for POSIX compliance
+
+# S3 publishing: one shared client/connection pool, uploads run concurrently and are reported in submission order
+s3Bucket = "lc-new-subjects"
+s3GzipThreshold = 1024 * 1024 # bodies larger than this are stored with Content-Encoding: gzip
+s3Client = None
+s3ClientLock = threading.Lock()
+publishPool = None
+pendingPublishes = []
+
+# use AWS CLI to configure local security credentials; --s3-endpoint points at a local stand-in (e.g., MinIO)
+# boto3's default session isn't thread-safe, so the client gets its own session, created once under a lock (and first from the main thread, see publishTweets)
+def getS3Client():
+    global s3Client
+    with s3ClientLock:
+        if s3Client is None:
+            import boto3
+            from botocore.config import Config
+            s3Client = boto3.session.Session().client("s3", endpoint_url=getOptionValue("--s3-endpoint"), config=Config(max_pool_connections=max(10, inputJobs * 2)))
+    return s3Client
+
+# md5 of the uncompressed body is kept in object metadata, since ETags of gzipped or multipart uploads can't be compared directly
+def getPublishedMD5(s3Key):
+    from botocore.exceptions import ClientError
+    try:
+        return getS3Client().head_object(Bucket=s3Bucket, Key=s3Key)["Metadata"].get("md5")
+    except ClientError as error:
+        if error.response["Error"]["Code"] in ["404", "NoSuchKey", "NotFound"]: return None
+        raise
+
+def uploadTweets(outputFilenameJSON, tweetsJSON):
+    s3Key = "input/" + outputFilenameJSON
+    tweetsBody = json.dumps(tweetsJSON, indent=2, default=str, ensure_ascii=False).encode("utf-8")
+    tweetsMD5 = hashlib.md5(tweetsBody).hexdigest()
+    if getPublishedMD5(s3Key) == tweetsMD5:
+        return f"[Unchanged {outputFilenameJSON} in {s3Bucket} bucket]\n"
+
+    uploadArgs = {"ContentType": "application/json", "Metadata": {"md5": tweetsMD5}}
+    if len(tweetsBody) > s3GzipThreshold:
+        tweetsBody = gzip.compress(tweetsBody)
+        uploadArgs["ContentEncoding"] = "gzip"
+    from boto3.s3.transfer import TransferConfig
+    s3TransferConfig = TransferConfig(multipart_threshold=8 * 1024 * 1024, max_concurrency=4)
+    getS3Client().upload_fileobj(io.BytesIO(tweetsBody), s3Bucket, s3Key, ExtraArgs=uploadArgs, Config=s3TransferConfig)
+    return f"[Saved {outputFilenameJSON} to {s3Bucket} bucket]\n"
+
+# upload time is measured in the publishing thread, so it overlaps (rather than adds to) the other stages' wall time
+def uploadTweetsTimed(outputFilenameJSON, tweetsJSON, stageTimer):
+    uploadStart = time.perf_counter()
+    try:
+        return uploadTweets(outputFilenameJSON, tweetsJSON)
+    finally:
+        stageTimer.add("upload", time.perf_counter() - uploadStart)
+
+def publishTweets(outputFilenameJSON, tweetsJSON, stageTimer):
+    global publishPool
+    if publishPool is None: publishPool = ThreadPoolExecutor(max_workers=max(4, inputJobs))
+    getS3Client()
+    pendingPublishes.append(publishPool.submit(uploadTweetsTimed, outputFilenameJSON, tweetsJSON, stageTimer))
+
+# raises the first failed upload (after clearing, so a later call doesn't report the same uploads again)
+def finishPublishing():
+    finishedPublishes = list(pendingPublishes)
+    pendingPublishes.clear()
+    for pendingPublish in finishedPublishes:
+        print(pendingPublish.result())
+
+# fetch in a thread, hand html off to the process pool for parsing (scrapeJSON is None if unchanged)
+def fetchAndParseList(parsePool, archiveManifest, listSourceURL, dateISO, saveId, stageTimer):
+    with stageTimer.stage("fetch"):
+        sourceHTML = fetchList(listSourceURL, getSaveName(listSourceURL, dateISO, saveId))
+    if isListUnchanged(archiveManifest, listSourceURL, dateISO, saveId, sourceHTML): return None, sourceHTML
+    scrapeJSON, parseTimings = parsePool.submit(parseListTimed, sourceHTML, listSourceURL, dateISO).result()
+    stageTimer.merge(parseTimings)
+    return scrapeJSON, sourceHTML
+
+# unchanged lists aren't rescraped, but --publish still (re)publishes their tweets from the archived scrape
+# (uploads of threads that are already in the bucket are skipped by uploadTweets' md5 check)
+def publishArchivedList(saveName, stageTimer):
+    with stageTimer.stage("tweets"):
+        tweetsJSON = toTwitterJSON(iterArchivedUpdates(saveName))
+    publishTweets(saveName + ".json", tweetsJSON, stageTimer)
 
 def runBatch():
     with open(inputBatchPath, "r") as infile:
         batchList = json.load(infile)
 
+    # only lists whose source html or parser changed since the last run get rescraped
+    archiveManifest = loadManifest()
+
+    if inputJobs > 1:
+        runBatchConcurrent(batchList, archiveManifest)
+        finishPublishing()
+        return
+
     for newRun in batchList:
         newListSourceURL = newRun["url"]
         newDateISO = newRun["date"]
         newSaveId = newRun["id"]
+        stageTimer = newStageTimer(getSaveName(newListSourceURL, newDateISO, newSaveId))
+
+        with stageTimer.stage("fetch"):
+            sourceHTML = fetchList(newListSourceURL, getSaveName(newListSourceURL, newDateISO, newSaveId))
+        if isListUnchanged(archiveManifest, newListSourceURL, newDateISO, newSaveId, sourceHTML):
+            stageTimer.record["unchanged"] = True
+            if not skipTweetsMode: publishArchivedList(getSaveName(newListSourceURL, newDateISO, newSaveId), stageTimer)
+            print(f"Unchanged: {getSaveName(newListSourceURL, newDateISO, newSaveId)}")
+            continue
+
+        # updates are written as they're parsed (tweet threads are built along the way), so the list is never held whole
+        tweetsJSON = None if skipTweetsMode else []
+        updates = collectUpdates(timeUpdates(sourceHTML, newListSourceURL, newDateISO, stageTimer), tweetsJSON, stageTimer=stageTimer)
+        saveFiles(newListSourceURL, newDateISO, newSaveId, updates, sourceHTML, tweetsJSON, stageTimer)
+
+        print(f"Done: {getSaveName(newListSourceURL, newDateISO, newSaveId)}")
+
+    finishPublishing()
+
+# overlap network waits in a thread pool, parse in a process pool; save and report in batch order
+# parse workers are started lazily from the fetch threads, so they come from a forkserver (or spawn) rather than a fork of this
+# multi-threaded process, which can deadlock on locks held by other threads (and would inherit --profile's tracemalloc tracing)
+def runBatchConcurrent(batchList, archiveManifest):
+    parseContext = multiprocessing.get_context("forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn")
+    with ThreadPoolExecutor(max_workers=inputJobs) as fetchPool, ProcessPoolExecutor(max_workers=inputJobs, mp_context=parseContext) as parsePool:
+        pendingRuns = []
+        for newRun in batchList:
+            stageTimer = newStageTimer(getSaveName(newRun["url"], newRun["date"], newRun["id"]))
+            pendingRuns.append((newRun, stageTimer, fetchPool.submit(fetchAndParseList, parsePool, archiveManifest, newRun["url"], newRun["date"], newRun["id"], stageTimer)))
+
+        for newRun, stageTimer, pendingRun in pendingRuns:
+            newListSourceURL = newRun["url"]
+            newDateISO = newRun["date"]
+            newSaveId = newRun["id"]
+
+            scrapeJSON, sourceHTML = pendingRun.result()
+            if scrapeJSON is None:
+                stageTimer.record["unchanged"] = True
+                if not skipTweetsMode: publishArchivedList(getSaveName(newListSourceURL, newDateISO, newSaveId), stageTimer)
+                print(f"Unchanged: {getSaveName(newListSourceURL, newDateISO, newSaveId)}")
+                continue
+
+            tweetsJSON = None
+            if not skipTweetsMode:
+                with stageTimer.stage("tweets"):
+                    tweetsJSON = toTwitterJSON(scrapeJSON)
+            saveFiles(newListSourceURL, newDateISO, newSaveId, scrapeJSON, sourceHTML, tweetsJSON, stageTimer)
+
+            print(f"Done: {getSaveName(newListSourceURL, newDateISO, newSaveId)}")
+
+def runStore():
+    if inputStoreCommand == "import":
+        importStore()
+    elif inputStoreCommand == "gc":
+        if not archiveStoreMode: raise Exception("No archive store to collect: ", str(storeRefsPath))
+        collectStoreGarbage()
+    else:
+        if not archiveStoreMode: raise Exception("No archive store to export from: ", str(storeRefsPath))
+        exportStore(inputExportPath)
+
+# flat tables for analytics: one row per update, plus one row per line (joined on updateId) with the MARC tag split from the text
+# listDate stays a string, since lists with no day are dated YYYY-MM
+exportBatchSize = 10000 # updates per write, so memory stays flat regardless of archive size
+exportUpdateColumns = ["updateId", "list", "listDate", "listSource", "recordId", "headingType", "LCLinkedDataURI", "LCCNPermalink"] + updateStatusKeys + ["lineCount"]
+exportLineColumns = ["updateId", "lineNum", "tag", "text"]
+marcLinePattern = re.compile(r"(\d{3}) (.*)", re.DOTALL)
+
+# archived lists in listDate order, filtered by their saveName's date without reading them; compares like query (--to 2022-06 includes all of June)
+def getExportNames(fromDate=None, toDate=None):
+    exportNames = []
+    for saveName in sorted(getArchivedNames(), key=lambda saveName: (saveName.split("--")[1], saveName)):
+        listDate = saveName.split("--")[1]
+        if fromDate and listDate < fromDate: continue
+        if toDate and listDate[:len(toDate)] > toDate: continue
+        exportNames.append(saveName)
+    return exportNames
+
+# (updateRows, lineRows) in batches, updates streamed from each list in turn
+def iterExportBatches(exportNames):
+    updateRows = []
+    lineRows = []
+    updateId = 0
+    for saveName in exportNames:
+        for update in iterArchivedUpdates(saveName):
+            updateId += 1
+            updateRows.append(
+                [updateId, saveName, update["listDate"], update["listSource"], getRecordId(update), update.headingType, update.LCLinkedDataURI, update.LCCNPermalink]
+                + [update[statusKey] for statusKey in updateStatusKeys]
+                + [len(update.lines)]
+            )
+            for lineNum, line in enumerate(update.lines, 1):
+                lineMatch = marcLinePattern.match(line)
+                lineRows.append([updateId, lineNum, lineMatch[1], lineMatch[2]] if lineMatch else [updateId, lineNum, None, line])
+
+            if len(updateRows) >= exportBatchSize:
+                yield updateRows, lineRows
+                updateRows = []
+                lineRows = []
+    if updateRows: yield updateRows, lineRows
+
+# booleans written as true/false, missing values as empty cells; returns the number of updates and lines written
+def writeExportCSV(exportPath, exportBatches):
+    updateCount = lineCount = 0
+    with open(exportPath / "updates.csv", "w", newline="") as updatesFile, open(exportPath / "lines.csv", "w", newline="") as linesFile:
+        updatesWriter = csv.writer(updatesFile)
+        linesWriter = csv.writer(linesFile)
+        updatesWriter.writerow(exportUpdateColumns)
+        linesWriter.writerow(exportLineColumns)
+        for updateRows, lineRows in exportBatches:
+            updatesWriter.writerows([str(value).lower() if isinstance(value, bool) else value for value in updateRow] for updateRow in updateRows)
+            linesWriter.writerows(lineRows)
+            updateCount += len(updateRows)
+            lineCount += len(lineRows)
+    return updateCount, lineCount
+
+# pyarrow is optional, only needed for --parquet; returns the number of updates and lines written
+def writeExportParquet(exportPath, exportBatches):
+    updateCount = lineCount = 0
+    try:
+        import pyarrow
+        import pyarrow.parquet
+    except ImportError:
+        raise Exception("Expected pyarrow to be installed for --parquet: ", "pip install pyarrow")
+
+    updatesSchema = pyarrow.schema(
+        [("updateId", pyarrow.int64())]
+        + [(columnName, pyarrow.string()) for columnName in exportUpdateColumns[1:8]]
+        + [(statusKey, pyarrow.bool_()) for statusKey in updateStatusKeys]
+        + [("lineCount", pyarrow.int32())]
+    )
+    linesSchema = pyarrow.schema([("updateId", pyarrow.int64()), ("lineNum", pyarrow.int32()), ("tag", pyarrow.string()), ("text", pyarrow.string())])
+
+    with pyarrow.parquet.ParquetWriter(exportPath / "updates.parquet", updatesSchema) as updatesWriter, pyarrow.parquet.ParquetWriter(exportPath / "lines.parquet", linesSchema) as linesWriter:
+        for updateRows, lineRows in exportBatches:
+            updatesWriter.write_table(pyarrow.Table.from_pydict(dict(zip(exportUpdateColumns, map(list, zip(*updateRows)))), schema=updatesSchema))
+            if lineRows: linesWriter.write_table(pyarrow.Table.from_pydict(dict(zip(exportLineColumns, map(list, zip(*lineRows)))), schema=linesSchema))
+            updateCount += len(updateRows)
+            lineCount += len(lineRows)
+    return updateCount, lineCount
+
+def runExport():
+    if not inputExportPath.exists(): inputExportPath.mkdir(parents=True)
+    exportNames = getExportNames(getOptionValue("--from"), getOptionValue("--to"))
+    if "--parquet" in commandArgs:
+        updateCount, lineCount = writeExportParquet(inputExportPath, iterExportBatches(exportNames))
+    else:
+        updateCount, lineCount = writeExportCSV(inputExportPath, iterExportBatches(exportNames))
+    print(f"Exported {updateCount} updates ({lineCount} lines) from {len(exportNames)} lists to {inputExportPath}/")
+
+def runQuery():
+    indexConnection = openIndex()
+    updateIndex(indexConnection)
+    matchingUpdates = queryIndex(
+        indexConnection,
+        text=inputQueryText,
+        recordId=getOptionValue("--record"),
+        headingType=getOptionValue("--type"),
+        status=getOptionValue("--status"),
+        fromDate=getOptionValue("--from"),
+        toDate=getOptionValue("--to"),
+        ftsSyntax="--fts" in commandArgs
+    )
+    writeUpdates(matchingUpdates, sys.stdout)
+    indexConnection.close()
+
+def runHistory():
+    indexConnection = openIndex()
+    updateIndex(indexConnection)
+    updateHistory(indexConnection)
+
+    if getOptionValue("--export"):
+        with open(getOptionValue("--export"), "w") as outfile:
+            exportHistory(indexConnection, outfile)
+    elif inputQueryText:
+        recordHistory = getRecordHistory(indexConnection, inputQueryText)
+        if not recordHistory: raise Exception("No history for record: ", inputQueryText)
+        print(json.dumps(recordHistory, indent=2, ensure_ascii=False))
+    indexConnection.close()
+
+# parse -> tweets -> serialize over every archived list (offline), timed per stage and diffed against the archived scrape
+def benchList(listSourceURL, dateISO, saveId):
+    saveName = getSaveName(listSourceURL, dateISO, saveId)
+    sourceHTML = readArchivedSource(saveName)
+    if sourceHTML is None: raise Exception("No archived source for list: ", saveName)
+
+    parseStart = time.perf_counter()
+    scrapeJSON = parseList(sourceHTML, listSourceURL, dateISO)
+    tweetsStart = time.perf_counter()
+    tweetsJSON = toTwitterJSON(scrapeJSON)
+    serializeStart = time.perf_counter()
+    scrapeBuffer = io.StringIO()
+    writeUpdates(scrapeJSON, scrapeBuffer)
+    json.dumps(tweetsJSON, indent=2, ensure_ascii=False)
+    serializeEnd = time.perf_counter()
+
+    # separate traced pass, since tracemalloc itself slows everything down
+    tracemalloc.start()
+    tracedScrapeJSON = parseList(sourceHTML, listSourceURL, dateISO)
+    tracedTweetsJSON = toTwitterJSON(tracedScrapeJSON)
+    writeUpdates(tracedScrapeJSON, io.StringIO())
+    json.dumps(tracedTweetsJSON, indent=2, ensure_ascii=False)
+    peakMemory = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    rowCount = sum(1 for row in iterListRows(sourceHTML))
+    matchesGolden = matchesArchivedScrape(saveName, scrapeJSON)
+    return {
+        "list": saveName,
+        "rows": rowCount,
+        "updates": len(scrapeJSON),
+        "parseSeconds": tweetsStart - parseStart,
+        "tweetsSeconds": serializeStart - tweetsStart,
+        "serializeSeconds": serializeEnd - serializeStart,
+        "peakMemoryBytes": peakMemory,
+        "matchesGolden": matchesGolden,
+        "goldenDifferences": None if matchesGolden else getGoldenDifferences(saveName, scrapeJSON)
+    }
+
+# which updates differ from the archived scrape (matched like diff mode), with the first one's changed fields, e.g., for tracking down a parser regression
+# all counts are 0 if the updates are the same and only the serialization differs
+def getGoldenDifferences(saveName, scrapeJSON):
+    archivedUpdates = list(iterArchivedUpdates(saveName)) if saveName in getArchivedNames() else []
+    updateChanges = diffUpdates(archivedUpdates, scrapeJSON)
+    goldenDifferences = {change: sum(1 for updateChange in updateChanges if updateChange[0] == change) for change in ["added", "removed", "modified"]}
+    goldenDifferences["first"] = None
+    if updateChanges:
+        change, updateKey, occurrence, previousUpdate, currentUpdate = updateChanges[0]
+        previousDict = previousUpdate.toDict() if previousUpdate else {}
+        currentDict = currentUpdate.toDict() if currentUpdate else {}
+        goldenDifferences["first"] = {
+            "change": change,
+            "key": updateKey,
+            "occurrence": occurrence,
+            "index": scrapeJSON.index(currentUpdate) if currentUpdate else archivedUpdates.index(previousUpdate),
+            "fields": [fieldName for fieldName in (currentDict or previousDict) if previousDict.get(fieldName) != currentDict.get(fieldName)]
+        }
+    return goldenDifferences
+
+def formatGoldenDifferences(goldenDifferences):
+    if goldenDifferences is None: return "OK"
+    differenceCounts = ", ".join(f"{goldenDifferences[change]} {change}" for change in ["added", "removed", "modified"] if goldenDifferences[change])
+    firstDifference = goldenDifferences["first"]
+    if firstDifference is None: return "DIFFERS FROM ARCHIVE (serialization only)"
+    return f"DIFFERS FROM ARCHIVE ({differenceCounts}; first: update {firstDifference['index']} {firstDifference['key']} {firstDifference['change']} {','.join(firstDifference['fields'])})"
+
+def getBenchTotals(benchLists):
+    benchTotals = {
+        "lists": len(benchLists),
+        "rows": sum(benchList["rows"] for benchList in benchLists),
+        "updates": sum(benchList["updates"] for benchList in benchLists),
+        "parseSeconds": sum(benchList["parseSeconds"] for benchList in benchLists),
+        "tweetsSeconds": sum(benchList["tweetsSeconds"] for benchList in benchLists),
+        "serializeSeconds": sum(benchList["serializeSeconds"] for benchList in benchLists),
+        "peakMemoryBytes": max(benchList["peakMemoryBytes"] for benchList in benchLists),
+        "goldenMismatches": [benchList["list"] for benchList in benchLists if not benchList["matchesGolden"]]
+    }
+    benchTotals["rowsPerSecond"] = benchTotals["rows"] / benchTotals["parseSeconds"]
+    benchTotals["updatesPerSecond"] = benchTotals["updates"] / (benchTotals["parseSeconds"] + benchTotals["tweetsSeconds"] + benchTotals["serializeSeconds"])
+    return benchTotals
+
+def formatBenchChange(benchTotals, previousTotals, key):
+    if not previousTotals or not previousTotals.get(key): return ""
+    return f" ({(benchTotals[key] - previousTotals[key]) / previousTotals[key]:+.1%} vs last run)"
+
+def getGitCommit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
 
-        scrapeJSON, sourceHTML = scrapeList(newListSourceURL, newDateISO)
-        saveFiles(newListSourceURL, newDateISO, newSaveId, scrapeJSON, sourceHTML, tweetsJSON=None)
-        # printSummary(scrapeJSON)
+def runBench():
+    with open(inputBatchPath, "r") as infile:
+        batchList = json.load(infile)
+
+    benchLists = []
+    for newRun in batchList:
+        benchLists.append(benchList(newRun["url"], newRun["date"], newRun["id"]))
+        listResult = benchLists[-1]
+        print(
+            f"{listResult['list']:<32} {listResult['rows']:>6} rows {listResult['updates']:>5} updates  "
+            f"parse {listResult['parseSeconds']:.3f}s  tweets {listResult['tweetsSeconds']:.3f}s  serialize {listResult['serializeSeconds']:.3f}s  "
+            f"peak {listResult['peakMemoryBytes'] / 1e6:.1f} MB  {formatGoldenDifferences(listResult['goldenDifferences'])}"
+        )
+
+    benchTotals = getBenchTotals(benchLists)
+    benchRecord = {
+        "commit": getGitCommit(),
+        "date": date.today().isoformat(),
+        "python": platform.python_version(),
+        "totals": benchTotals,
+        "lists": benchLists
+    }
 
-        listSourceFilename = Path(newListSourceURL).stem
-        print(f"Done: {newSaveId}--{newDateISO}--{listSourceFilename}")
+    # results accumulate in bench/results.ndjson, one record per run; compare against the previous run
+    benchResultsPath = Path("./bench/results.ndjson")
+    previousTotals = None
+    if benchResultsPath.exists():
+        previousLines = benchResultsPath.read_text().splitlines()
+        if previousLines: previousTotals = json.loads(previousLines[-1])["totals"]
+
+    print(
+        "",
+        "-----------------------------------",
+        f"Lists:                        {benchTotals['lists']:>5}",
+        f"Rows:                         {benchTotals['rows']:>5}",
+        f"Updates:                      {benchTotals['updates']:>5}",
+        "-----------------------------------",
+        f"Parse:                        {benchTotals['parseSeconds']:.2f}s{formatBenchChange(benchTotals, previousTotals, 'parseSeconds')}",
+        f"Tweets:                       {benchTotals['tweetsSeconds']:.2f}s{formatBenchChange(benchTotals, previousTotals, 'tweetsSeconds')}",
+        f"Serialize:                    {benchTotals['serializeSeconds']:.2f}s{formatBenchChange(benchTotals, previousTotals, 'serializeSeconds')}",
+        f"Rows/s (parse):               {benchTotals['rowsPerSecond']:.0f}{formatBenchChange(benchTotals, previousTotals, 'rowsPerSecond')}",
+        f"Updates/s (pipeline):         {benchTotals['updatesPerSecond']:.0f}{formatBenchChange(benchTotals, previousTotals, 'updatesPerSecond')}",
+        f"Peak memory (largest list):   {benchTotals['peakMemoryBytes'] / 1e6:.1f} MB{formatBenchChange(benchTotals, previousTotals, 'peakMemoryBytes')}",
+        "-----------------------------------",
+        f"Differs from archive:         {len(benchTotals['goldenMismatches']):>5}",
+        *benchTotals["goldenMismatches"],
+        "",
+        sep="\n"
+    )
+
+    if not benchResultsPath.parent.exists(): benchResultsPath.parent.mkdir(parents=True)
+    with open(benchResultsPath, "a") as outfile:
+        outfile.write(json.dumps(benchRecord) + "\n")
+
+# scrape -> save (tweets and summary built as updates are written) -> summary -> publish for one list (fetched here unless the html is already in hand)
+def runList(listSourceURL, dateISO, saveId, sourceHTML=None):
+    stageTimer = newStageTimer(getSaveName(listSourceURL, dateISO, saveId) if saveId else "output")
+    if sourceHTML is None:
+        with stageTimer.stage("fetch"):
+            sourceHTML = fetchList(listSourceURL, getSaveName(listSourceURL, dateISO, saveId) if saveId else None)
+
+    summaryCounts = newSummaryCounts()
+    tweetsJSON = None if skipTweetsMode else []
+    updates = collectUpdates(timeUpdates(sourceHTML, listSourceURL, dateISO, stageTimer), tweetsJSON, summaryCounts, stageTimer)
+    saveFiles(listSourceURL, dateISO, saveId, updates, sourceHTML, tweetsJSON, stageTimer)
+    printSummaryCounts(summaryCounts)
+    finishPublishing()
 
 def runSingle():
-    scrapeJSON, sourceHTML = scrapeList(inputListSourceURL, inputDateISO)
-    printSummary(scrapeJSON)
+    runList(inputListSourceURL, inputDateISO, inputSaveId)
+
+# updates are matched across revisions by record ID (or first line, if there isn't one) and occurrence, since a record can appear more than once
+def getUpdateKey(update):
+    return getRecordId(update) or (update.lines[0] if update.lines else "")
 
-    tweetsJSON = toTwitterJSON(scrapeJSON) if not skipTweetsMode else None
-    saveFiles(inputListSourceURL, inputDateISO, inputSaveId, scrapeJSON, sourceHTML, tweetsJSON)
+# hash of everything that can change between revisions (listDate/listSource are the same for every update in a list)
+def getUpdateHash(update):
+    return hashlib.blake2b(json.dumps([update.headingType, update.LCLinkedDataURI, update.statusFlags, update.lines], ensure_ascii=False).encode("utf-8"), digest_size=16).digest()
+
+# (change, key, occurrence, previousUpdate, currentUpdate) for every added/removed/modified update, linear in list size
+def diffUpdates(previousUpdates, currentUpdates):
+    previousHashes = {}
+    keyCounts = {}
+    for update in previousUpdates:
+        updateKey = getUpdateKey(update)
+        occurrence = keyCounts[updateKey] = keyCounts.get(updateKey, -1) + 1
+        previousHashes[(updateKey, occurrence)] = (getUpdateHash(update), update)
+
+    updateChanges = []
+    keyCounts = {}
+    for update in currentUpdates:
+        updateKey = getUpdateKey(update)
+        occurrence = keyCounts[updateKey] = keyCounts.get(updateKey, -1) + 1
+        previousHash, previousUpdate = previousHashes.pop((updateKey, occurrence), (None, None))
+        if previousUpdate is None:
+            updateChanges.append(("added", updateKey, occurrence, None, update))
+        elif previousHash != getUpdateHash(update):
+            updateChanges.append(("modified", updateKey, occurrence, previousUpdate, update))
+
+    for (updateKey, occurrence), (previousHash, previousUpdate) in previousHashes.items():
+        updateChanges.append(("removed", updateKey, occurrence, previousUpdate, None))
+    return updateChanges
+
+# compare a fresh copy of an archived list against its archived scrape, writing output/diff.json and tweets for added/modified updates only
+def runDiff():
+    saveName = getSaveName(inputListSourceURL, inputDateISO, inputSaveId)
+    if saveName not in getArchivedNames(): raise Exception("No archived scrape to diff against: ", saveName)
+    previousUpdates = list(iterArchivedUpdates(saveName))
+
+    stageTimer = newStageTimer(saveName)
+    currentUpdates, sourceHTML = scrapeList(inputListSourceURL, inputDateISO, inputSaveId, stageTimer)
+    updateChanges = diffUpdates(previousUpdates, currentUpdates)
+    changeCounts = {change: sum(1 for updateChange in updateChanges if updateChange[0] == change) for change in ["added", "removed", "modified"]}
+
+    with stageTimer.stage("tweets"):
+        tweetsJSON = toTwitterJSON([updateChange[4] for updateChange in updateChanges if updateChange[4] is not None])
+
+    with stageTimer.stage("write"):
+        if not Path("./output/").exists(): Path("./output/").mkdir()
+        with open("./output/diff.json", "w") as outfile:
+            json.dump([
+                {
+                    "change": change,
+                    "key": updateKey,
+                    "occurrence": occurrence,
+                    "previous": previousUpdate.toDict() if previousUpdate else None,
+                    "current": currentUpdate.toDict() if currentUpdate else None
+                }
+                for change, updateKey, occurrence, previousUpdate, currentUpdate in updateChanges
+            ], outfile, indent=2, ensure_ascii=False)
+            outfile.write("\n") # ensure newline at EOF for POSIX compliance
+
+        with open("./output/tweets.json", "w") as outfile:
+            json.dump(tweetsJSON, outfile, indent=2, ensure_ascii=False)
+            outfile.write("\n")
+
+    print(
+        "",
+        f"{saveName}",
+        "-----------------------------------",
+        f"Archived updates:             {len(previousUpdates):>5}",
+        f"Current updates:              {len(currentUpdates):>5}",
+        "-----------------------------------",
+        f"Added:                        {changeCounts['added']:>5}",
+        f"Removed:                      {changeCounts['removed']:>5}",
+        f"Modified:                     {changeCounts['modified']:>5}",
+        f"Unchanged:                    {len(currentUpdates) - changeCounts['added'] - changeCounts['modified']:>5}",
+        "-----------------------------------",
+        "",
+        sep="\n"
+    )
+
+    # --save replaces the archived copy; --publish uploads a thread for just the changes, under its own name so the original thread is kept
+    if "--save" in commandArgs:
+        saveFiles(inputListSourceURL, inputDateISO, inputSaveId, currentUpdates, sourceHTML, stageTimer=stageTimer)
+    if "--publish" in commandArgs and tweetsJSON:
+        publishTweets(saveName + "--changes--" + date.today().isoformat() + ".json", tweetsJSON, stageTimer)
+        finishPublishing()
+
+# approved lists are linked from the index by filename, e.g., 2302e.html
+indexListPattern = re.compile(r"""href\s*=\s*["']?([^"'\s>]*?(\d{4}[a-z]*)\.html)["'\s>]""", re.IGNORECASE)
+listDatePattern = re.compile(r"<title>[^<]*\((January|February|March|April|May|June|July|August|September|October|November|December)\s+(?:(\d{1,2}),\s+)?(\d{4})\)", re.IGNORECASE)
+monthNames = ["january", "february", "march", "april", "may", "june", "july", "august", "september", "october", "november", "december"]
+
+# list urls linked from the index, in page order (stems are what identify a list, since hosts/paths may differ)
+def getIndexListURLs(indexHTML, indexURL):
+    indexListURLs = {}
+    for href, listStem in indexListPattern.findall(indexHTML):
+        indexListURLs.setdefault(listStem.lower(), urljoin(indexURL, href))
+    return indexListURLs
+
+# list date from the title, e.g., (February 17, 2023) -> 2023-02-17, (November 2021) -> 2021-11
+def getListDate(sourceHTML):
+    dateMatch = listDatePattern.search(sourceHTML)
+    if not dateMatch: return None
+    monthName, dayNum, yearNum = dateMatch.groups()
+    dateISO = f"{yearNum}-{monthNames.index(monthName.lower()) + 1:02d}"
+    return dateISO + f"-{int(dayNum):02d}" if dayNum else dateISO
+
+# IDs of archived lists count as taken even if they're not in archive/batch.json (e.g., a list that was saved but failed to publish)
+def getNextSaveId(batchList, archivedNames):
+    savedIds = [int(batchRun["id"]) for batchRun in batchList] + [int(saveName.split("--")[0]) for saveName in archivedNames if saveName.split("--")[0].isdigit()]
+    return f"{max(savedIds, default=0) + 1:04d}"
+
+# ID a list was already archived under by an earlier, failed attempt (so a retry overwrites it rather than saving another copy)
+def getRetrySaveId(batchList, archivedNames, listSourceURL, dateISO):
+    batchIds = set(batchRun["id"] for batchRun in batchList)
+    for saveName in archivedNames:
+        saveId = saveName.split("--")[0]
+        if saveId not in batchIds and saveName == getSaveName(listSourceURL, dateISO, saveId): return saveId
+    return None
+
+# scrape/save/publish every list on the index that isn't in archive/batch.json yet, assigning IDs in index order
+# a list that fails (dead link, parse error, failed upload) is logged and skipped; it isn't added to archive/batch.json,
+# so it's retried on the next poll, under the ID it was saved with if it got that far; returns the number of failed lists
+def scrapeNewLists(indexHTML):
+    with open("./archive/batch.json", "r") as infile:
+        batchList = json.load(infile)
+    archivedStems = set(Path(batchRun["url"]).stem.lower() for batchRun in batchList)
+
+    failedLists = 0
+    for listStem, listSourceURL in getIndexListURLs(indexHTML, inputIndexURL).items():
+        if listStem in archivedStems: continue
+        try:
+            sourceHTML = fetchCached(listSourceURL)
+            dateISO = getListDate(sourceHTML)
+            if dateISO is None:
+                print(f"Skipped (no date in title, scrape manually): {listSourceURL}")
+                continue
+
+            archivedNames = getArchivedNames()
+            saveId = getRetrySaveId(batchList, archivedNames, listSourceURL, dateISO) or getNextSaveId(batchList, archivedNames)
+            print(f"New list: {getSaveName(listSourceURL, dateISO, saveId)}")
+            runList(listSourceURL, dateISO, saveId, sourceHTML)
+            appendBatchRun(listSourceURL, dateISO, saveId)
+            batchList.append({"id": saveId, "date": dateISO, "url": listSourceURL})
+        except Exception as error:
+            failedLists += 1
+            print(f"Failed (retrying next poll): {listSourceURL}: {error!r}")
+        emitTimings()
+    return failedLists
+
+# exponential backoff after failed polls (capped at 16x), +/-20% jitter so restarts don't poll in lockstep
+def getPollDelay(failedPolls):
+    return inputPollSeconds * min(2 ** failedPolls, 16) * random.uniform(0.8, 1.2)
+
+# poll the index with conditional GETs (a 304 costs one round trip), only scanning for new lists when it changed
+# (or when a list failed last time); only failing to fetch the index itself counts toward backoff
+def runWatch():
+    import requests
+    lastIndexHash = None
+    failedPolls = 0
+    while True:
+        try:
+            indexHTML = fetchCached(inputIndexURL)
+            if getSourceHash(indexHTML) != lastIndexHash:
+                failedLists = scrapeNewLists(indexHTML)
+                lastIndexHash = getSourceHash(indexHTML) if failedLists == 0 else None
+            failedPolls = 0
+        except requests.RequestException as error:
+            failedPolls += 1
+            print(f"Poll failed ({failedPolls} in a row): {error}")
+
+        if "--once" in commandArgs: return
+        time.sleep(getPollDelay(failedPolls))
+
+timingStages = ["fetch", "tokenize", "classify", "tweets", "write", "index", "upload"]
+
+def getTimingTotals(timingRecords):
+    timingTotals = {
+        "lists": len(timingRecords),
+        "unchanged": sum(1 for timingRecord in timingRecords if timingRecord.get("unchanged")),
+        "updates": sum(timingRecord.get("updates", 0) for timingRecord in timingRecords)
+    }
+    for stageName in timingStages:
+        timingTotals[stageName + "Seconds"] = sum(timingRecord.get(stageName + "Seconds", 0.0) for timingRecord in timingRecords)
+    return timingTotals
+
+# one NDJSON record per list (plus a summary record per batch) appended to output/timings.ndjson
+def emitTimings():
+    if not stageTimers: return
+    timingRecords = [stageTimer.record for stageTimer in stageTimers]
+    for timingRecord in timingRecords:
+        timingRecord["totalSeconds"] = sum(timingRecord.get(stageName + "Seconds", 0.0) for stageName in timingStages)
+    timingTotals = getTimingTotals(timingRecords)
+
+    print(
+        "",
+        f"{'Timings (s)':<32}" + "".join(f"{stageName:>9}" for stageName in timingStages + ["total"]),
+        *[
+            f"{timingRecord['list']:<32}" + "".join(f"{timingRecord.get(stageName + 'Seconds', 0.0):>9.3f}" for stageName in timingStages + ["total"])
+            for timingRecord in timingRecords
+        ],
+        "-" * (32 + 9 * (len(timingStages) + 1)),
+        f"{'Total (' + str(timingTotals['lists']) + ' lists)':<32}" + "".join(f"{timingTotals[stageName + 'Seconds']:>9.3f}" for stageName in timingStages) + f"{sum(timingRecord['totalSeconds'] for timingRecord in timingRecords):>9.3f}",
+        "",
+        sep="\n"
+    )
+
+    if not Path("./output/").exists(): Path("./output/").mkdir()
+    with open("./output/timings.ndjson", "a") as outfile:
+        for timingRecord in timingRecords:
+            outfile.write(json.dumps(timingRecord) + "\n")
+        if batchMode:
+            outfile.write(json.dumps({"batch": inputBatchPath, "date": date.today().isoformat(), "totals": timingTotals}) + "\n")
+    stageTimers.clear()
+
+# cProfile + tracemalloc around a whole run, report written to output/profile.txt (raw stats to output/profile.pstats)
+# with --jobs > 1, parsing happens in worker processes and only shows up here as time waiting on results
+def runProfiled(runFunction):
+    profiler = cProfile.Profile()
+    tracemalloc.start()
+    profiler.enable()
+    try:
+        runFunction()
+    finally:
+        profiler.disable()
+        peakMemory = tracemalloc.get_traced_memory()[1] if tracemalloc.is_tracing() else None
+        topAllocations = tracemalloc.take_snapshot().statistics("lineno")[:20] if tracemalloc.is_tracing() else []
+        tracemalloc.stop()
+
+        if not Path("./output/").exists(): Path("./output/").mkdir()
+        profiler.dump_stats("./output/profile.pstats")
+        with open("./output/profile.txt", "w") as outfile:
+            outfile.write(f"Peak traced memory: {peakMemory / 1e6:.1f} MB\n\n" if peakMemory is not None else "Peak traced memory: n/a\n\n")
+            outfile.write("Top allocations (by line):\n")
+            for allocation in topAllocations:
+                outfile.write(f"{allocation}\n")
+            outfile.write("\n")
+            pstats.Stats(profiler, stream=outfile).sort_stats("cumulative").print_stats(40)
+        print("[Saved profile to output/profile.txt]")
+
+def runCommand():
+    if batchMode:
+        runBatch()
+    elif queryMode:
+        runQuery()
+    elif historyMode:
+        runHistory()
+    elif benchMode:
+        runBench()
+    elif watchMode:
+        runWatch()
+    elif diffMode:
+        runDiff()
+    elif storeMode:
+        runStore()
+    elif exportMode:
+        runExport()
+    else:
+        runSingle()
+    emitTimings()
+
+# command line entry point, e.g., main(["scrape.py", "--batch", "--offline"])
+# drop state left over from an earlier main() call in the same process
+def resetRunState():
+    global archiveStoreMode, httpSession, s3Client, publishPool
+    archiveStoreMode = storeRefsPath.exists()
+    if httpSession is not None: httpSession.close()
+    httpSession = None
+    s3Client = None
+    if publishPool is not None: publishPool.shutdown()
+    publishPool = None
+    pendingPublishes.clear()
+    stageTimers.clear()
+
+def main(argv=None):
+    parseArgs(argv or sys.argv)
+    resetRunState()
+    if profileMode:
+        runProfiled(runCommand)
+    else:
+        runCommand()
 
-runBatch() if batchMode else runSingle()
+if __name__ == "__main__":
+    main()